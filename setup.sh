@@ -2,7 +2,7 @@
 
 sudo apt update
 
-sudo apt install -y tesseract-ocr libtesseract-dev
+sudo apt install -y tesseract-ocr libtesseract-dev libleptonica-dev
 
 pip install --upgrade pip==22.3.1 setuptools==65.6.3 wheel==0.38.4
 
@@ -0,0 +1,628 @@
+"""
+Benchmarks and parity checks for individual pipeline stages
+Run from the repository root so that config.yaml is found, e.g.
+  python src/benchmark.py parallel_ocr data/example.pdf --workers 8
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from reference_implementations import classify_heading_type_rowwise, detect_authors_per_page, detect_page_layout_rowwise, \
+  find_author_name_linear, remove_initial_capitals_rowwise
+from synthetic import make_synthetic_author_names, make_synthetic_blocks_df, make_synthetic_initial_caps_df, make_synthetic_pdf, \
+  make_synthetic_segmentation_corpus
+from utils import load_config
+
+config = load_config()
+
+# Serial and process-pool OCR must produce byte-identical DataFrames
+def check_parallel_ocr_parity(pdf_file_path, workers):
+  import ocr_cache
+  from ocr import pdf_to_ocr_scanned_df
+  ocr_cache.config['ocr_cache']['enabled'] = False # the parallel run must OCR every page, not read back the serial run's
+  start = time.perf_counter()
+  serial_df = pdf_to_ocr_scanned_df(pdf_file_path, workers=1)
+  serial_time = time.perf_counter() - start
+
+  start = time.perf_counter()
+  parallel_df = pdf_to_ocr_scanned_df(pdf_file_path, workers=workers)
+  parallel_time = time.perf_counter() - start
+
+  identical = serial_df.to_csv().encode() == parallel_df.to_csv().encode() and serial_df.equals(parallel_df)
+  logging.info(f'Serial: {serial_time:.1f}s, {workers} workers: {parallel_time:.1f}s, identical output: {identical}')
+  return identical
+
+# Pages/sec of per-page layout detection against a single batched forward pass per batch_size pages
+def benchmark_batched_layout(pdf_file_path, batch_size, max_pages):
+  import ocr
+  from utils import load_fitz_file
+  ocr.init_models()
+  pdf_file = load_fitz_file(pdf_file_path)
+  imgs = [ocr.page_to_enhanced_img(pdf_file[i]) for i in range(min(max_pages, pdf_file.page_count))]
+  pdf_file.close()
+
+  start = time.perf_counter()
+  per_page_layouts = [ocr.detect_layouts([img])[0] for img in imgs]
+  per_page_rate = len(imgs) / (time.perf_counter() - start)
+
+  start = time.perf_counter()
+  batched_layouts = []
+  for i in range(0, len(imgs), batch_size):
+    batched_layouts += ocr.detect_layouts(imgs[i:i+batch_size])
+  batched_rate = len(imgs) / (time.perf_counter() - start)
+
+  same_block_counts = [len(a) for a in per_page_layouts] == [len(b) for b in batched_layouts]
+  logging.info(f'Per-page: {per_page_rate:.2f} pages/sec, batch of {batch_size}: {batched_rate:.2f} pages/sec, '
+    f'same number of blocks per page: {same_block_counts}')
+  return per_page_rate, batched_rate
+
+# Character-level agreement between per-crop Tesseract calls and the persistent region-of-interest engine
+def check_ocr_engine_parity(pdf_file_path, max_pages):
+  import difflib
+  import ocr
+  import registry
+  from utils import load_fitz_file
+  ocr.init_models()
+  registry.get('tesseract_api')
+  normalise = lambda text: ' '.join(text.split())
+  pdf_file = load_fitz_file(pdf_file_path)
+  timings = {'per_crop': 0, 'tesserocr': 0}
+  similarities = []
+  for page_number in range(min(max_pages, pdf_file.page_count)):
+    img = ocr.page_to_enhanced_img(pdf_file[page_number])
+    layout_result = ocr.detect_layouts([img])[0]
+    texts = {}
+    for engine in timings:
+      ocr.config['ocr']['engine'] = engine
+      start = time.perf_counter()
+      texts[engine] = [normalise(b.text) for b in ocr.img_to_text_blocks(img, layout_result)]
+      timings[engine] += time.perf_counter() - start
+    similarities += [difflib.SequenceMatcher(None, a, b).ratio() for a, b in zip(texts['per_crop'], texts['tesserocr'])]
+  pdf_file.close()
+
+  exact_matches = sum(similarity == 1 for similarity in similarities)
+  logging.info(f'Per-crop: {timings["per_crop"]:.1f}s, tesserocr: {timings["tesserocr"]:.1f}s, '
+    f'{exact_matches}/{len(similarities)} blocks identical, mean similarity {sum(similarities) / max(1, len(similarities)):.4f}')
+  return similarities
+
+# Runs in a fresh process so that the peak resident memory belongs to a single render mode
+def render_pages(pdf_file_path, render_mode, max_pages):
+  import ocr
+  from utils import load_fitz_file
+  ocr.config['ocr']['render_mode'] = render_mode
+  pdf_file = load_fitz_file(pdf_file_path)
+  page_count = min(max_pages, pdf_file.page_count)
+  baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  start = time.perf_counter()
+  for page_number in range(page_count):
+    if render_mode == 'gray':
+      pix, img = ocr.page_to_gray_img(pdf_file[page_number])
+    else:
+      pix, img = ocr.page_to_img(pdf_file[page_number])
+      img = ocr.pre_process_img(img)
+  elapsed = time.perf_counter() - start
+  pdf_file.close()
+  peak_rss_increase = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline_rss
+  return elapsed / page_count, peak_rss_increase
+
+# Render time and peak memory of PNG round-trip rendering against direct grayscale rendering
+def benchmark_render(pdf_file_path, max_pages):
+  results = {}
+  for render_mode in ['png', 'gray']:
+    with ProcessPoolExecutor(max_workers=1) as executor:
+      results[render_mode] = executor.submit(render_pages, pdf_file_path, render_mode, max_pages).result()
+    seconds_per_page, peak_rss_increase = results[render_mode]
+    logging.info(f'{render_mode}: {seconds_per_page:.3f}s per page, peak RSS increase {peak_rss_increase / 1024:.0f} MB')
+  return results
+
+# Per-page thresholding time of the standard and fast enhancement, and the fraction of pixels on which they agree
+def benchmark_thresholding(pdf_file_path, max_pages, downsample_factors):
+  import numpy as np
+  import ocr
+  from utils import load_fitz_file
+  pdf_file = load_fitz_file(pdf_file_path)
+  imgs = []
+  for page_number in range(min(max_pages, pdf_file.page_count)):
+    pix, img = ocr.render_page(pdf_file[page_number])
+    imgs.append(ocr.unsharp_mask(ocr.pre_process_img(img)))
+  pdf_file.close()
+
+  results = {}
+  for enhancement, factor in [('standard', None)] + [('fast', factor) for factor in downsample_factors]:
+    ocr.config['ocr']['enhancement'] = enhancement
+    ocr.config['ocr']['macro_downsample'] = factor
+    start = time.perf_counter()
+    results[(enhancement, factor)] = [ocr.thresholding(img) for img in imgs]
+    seconds_per_page = (time.perf_counter() - start) / len(imgs)
+    agreement = np.mean([np.mean(a == b) for a, b in zip(results[('standard', None)], results[(enhancement, factor)])])
+    logging.info(f'{enhancement}{f" (1/{factor} scale macro mask)" if factor else ""}: {seconds_per_page:.3f}s per page, '
+      f'{agreement:.4%} of pixels agree with standard')
+  return results
+
+# CPU time of this process and its children (Tesseract runs as a subprocess with the per-crop engine)
+def cpu_time():
+  return sum(usage.ru_utime + usage.ru_stime for usage in map(resource.getrusage, [resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN]))
+
+# Runs in a fresh process so that the peak resident memory belongs to a single resolution mode
+def ocr_pages(pdf_file_path, multi_resolution, max_pages):
+  import ocr
+  import ocr_cache
+  from utils import load_fitz_file
+  ocr_cache.config['ocr_cache']['enabled'] = False
+  ocr.config['ocr']['multi_resolution']['enabled'] = multi_resolution
+  ocr.init_models()
+  pdf_file = load_fitz_file(pdf_file_path)
+  page_numbers = list(range(min(max_pages, pdf_file.page_count)))
+  baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  start = cpu_time()
+  pages_text_blocks = list(ocr.pdf_pages_to_text_blocks_serial(pdf_file, pdf_file_path, page_numbers))
+  cpu_seconds_per_page = (cpu_time() - start) / len(page_numbers)
+  pdf_file.close()
+  return cpu_seconds_per_page, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline_rss, pages_text_blocks
+
+# CPU time and peak memory per page of full-resolution OCR against multi-resolution OCR, and how closely their text agrees
+def benchmark_multi_resolution(pdf_file_path, max_pages):
+  import difflib
+  results = {}
+  for multi_resolution in [False, True]:
+    with ProcessPoolExecutor(max_workers=1) as executor:
+      results[multi_resolution] = executor.submit(ocr_pages, pdf_file_path, multi_resolution, max_pages).result()
+    cpu_seconds_per_page, peak_rss_increase, pages_text_blocks = results[multi_resolution]
+    logging.info(f'{"multi-resolution" if multi_resolution else "full resolution"}: {cpu_seconds_per_page:.2f}s CPU per page, '
+      f'peak RSS increase {peak_rss_increase / 1024:.0f} MB, {sum(map(len, pages_text_blocks))} text blocks')
+
+  page_text = lambda text_blocks: ' '.join(' '.join(text_block['text'].split()) for text_block in text_blocks)
+  similarities = [difflib.SequenceMatcher(None, page_text(a), page_text(b)).ratio() for a, b in zip(results[False][2], results[True][2])]
+  logging.info(f'CPU saving {1 - results[True][0] / results[False][0]:.0%} per page, memory saving '
+    f'{1 - results[True][1] / max(1, results[False][1]):.0%}; mean page text similarity {sum(similarities) / len(similarities):.4f}')
+  return results
+
+# Runs in a fresh process so that the peak resident memory belongs to a single pipeline mode and document length
+def run_pipeline_for_memory(pdf_file_path, streaming, output_dir):
+  import main as pipeline
+  from ocr import pdf_to_ocr_scanned_df
+  from preprocessing import preprocessing
+  from detect_structure_elements import classify_heading_type, remove_headers_footers
+  from detect_page_layout import detect_page_layout
+  from ner import detect_authors
+  baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  start = time.perf_counter()
+  if streaming:
+    pipeline.process_pdfs([pdf_file_path], output_dir, streaming=True)
+  else: # the same stages as process_pdf_pipeline, holding the whole document's DataFrame
+    df = detect_authors(detect_page_layout(classify_heading_type(remove_headers_footers(preprocessing(pdf_to_ocr_scanned_df(pdf_file_path))))))
+  elapsed = time.perf_counter() - start
+  return elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline_rss
+
+# Peak memory of the whole-document and streaming pipelines as the synthetic document grows
+def benchmark_streaming_memory(page_counts):
+  results = {}
+  with tempfile.TemporaryDirectory() as tmp_dir:
+    for page_count in page_counts:
+      pdf_file_path = f'{tmp_dir}/synthetic_{page_count}.pdf'
+      make_synthetic_pdf(pdf_file_path, page_count)
+      for streaming in [False, True]:
+        with ProcessPoolExecutor(max_workers=1) as executor:
+          elapsed, peak_rss_increase = executor.submit(run_pipeline_for_memory, pdf_file_path, streaming, tmp_dir).result()
+        results[(page_count, streaming)] = (elapsed, peak_rss_increase)
+        logging.info(f'{page_count} pages, {"streaming" if streaming else "whole document"}: {elapsed:.1f}s, '
+          f'peak RSS increase {peak_rss_increase / 1024:.0f} MB')
+  return results
+
+# Text blocks with the columns produced by pdf_to_ocr_scanned_df, in 2, 3 and 4-column page layouts
+def load_blocks_df(blocks_df_path, block_count):
+  import pandas
+  return pandas.read_pickle(blocks_df_path) if blocks_df_path else make_synthetic_blocks_df(block_count)
+
+# Blocks/sec of the row-wise and vectorised layout assignment, which must agree on every block's column
+def benchmark_page_layout(blocks_df_path, block_count):
+  from detect_page_layout import detect_page_layout
+  df = load_blocks_df(blocks_df_path, block_count)
+  start = time.perf_counter()
+  rowwise_df = detect_page_layout_rowwise(df.copy())
+  rowwise_rate = len(df) / (time.perf_counter() - start)
+  start = time.perf_counter()
+  vectorised_df = detect_page_layout(df.copy())
+  vectorised_rate = len(df) / (time.perf_counter() - start)
+
+  identical = rowwise_df['column_position'].tolist() == vectorised_df['column_position'].tolist()
+  logging.info(f'Row-wise: {rowwise_rate:,.0f} blocks/sec, vectorised: {vectorised_rate:,.0f} blocks/sec, identical columns: {identical}')
+  return identical
+
+# Blocks/sec of the row-wise and columnar header/footer filtering and heading classification, which must agree
+def benchmark_structure_elements(blocks_df_path, block_count):
+  from detect_structure_elements import remove_headers_footers, classify_heading_type
+  df = load_blocks_df(blocks_df_path, block_count).reset_index(drop=True)
+  start = time.perf_counter()
+  rowwise_df = classify_heading_type_rowwise(df.copy())
+  rowwise_rate = len(df) / (time.perf_counter() - start)
+  start = time.perf_counter()
+  columnar_df = classify_heading_type(remove_headers_footers(df.copy()).copy())
+  columnar_rate = len(df) / (time.perf_counter() - start)
+
+  rowwise_df, columnar_df = rowwise_df.sort_index(), columnar_df.sort_index()
+  identical = rowwise_df.index.equals(columnar_df.index) \
+    and all(rowwise_df[column].tolist() == columnar_df[column].tolist() for column in ['font_size', 'heading_type'])
+  logging.info(f'Row-wise: {rowwise_rate:,.0f} blocks/sec, columnar: {columnar_rate:,.0f} blocks/sec, identical output: {identical}')
+  return identical
+
+# Pages/sec of per-page and batched author detection on a classified DataFrame, which must find the same authors
+def benchmark_batched_ner(classified_df_path):
+  import pandas
+  import ner
+  df = pandas.read_pickle(classified_df_path)
+  ner.init_models()
+  page_count = df.groupby(['pdf_file', 'page_number']).ngroups
+  start = time.perf_counter()
+  per_page_authors = detect_authors_per_page(df)
+  per_page_rate = page_count / (time.perf_counter() - start)
+  start = time.perf_counter()
+  batched_authors = ner.detect_authors(df.copy())['author'].tolist()
+  batched_rate = page_count / (time.perf_counter() - start)
+
+  identical = per_page_authors == batched_authors
+  logging.info(f'Per-page: {per_page_rate:.1f} pages/sec, batches of {config["ner"]["batch_size"]}: {batched_rate:.1f} pages/sec, '
+    f'identical authors: {identical}')
+  return identical
+
+# Microseconds per lookup of the original linear scan against the trigram index, and how often they agree
+def benchmark_author_name_matching(name_count, query_count):
+  from Levenshtein import ratio
+  import ner
+  names, queries = make_synthetic_author_names(name_count, query_count)
+  score_cutoff = config['ner']['score_cutoff']
+  start = time.perf_counter()
+  linear_matches = [find_author_name_linear(names, query, score_cutoff) for query in queries]
+  linear_time = (time.perf_counter() - start) / len(queries)
+  start = time.perf_counter()
+  index = ner.AuthorNamesIndex(names)
+  build_time = time.perf_counter() - start
+  start = time.perf_counter()
+  indexed_matches = [index.best_match(query, score_cutoff) for query in queries]
+  indexed_time = (time.perf_counter() - start) / len(queries)
+
+  # The index returns the best match, which may score higher than the first match found by the linear scan
+  found = sum(linear is not None for linear in linear_matches)
+  agreeing = sum(linear is not None and indexed is not None and ratio(indexed, query) >= ratio(linear, query)
+    for linear, indexed, query in zip(linear_matches, indexed_matches, queries))
+  logging.info(f'{len(names):,} names: linear scan {linear_time * 1e6:,.0f}us per lookup, index {indexed_time * 1e6:,.0f}us per lookup '
+    f'(built in {build_time:.1f}s); index matched as well or better on {agreeing}/{found} queries matched by the linear scan')
+  return agreeing == found
+
+# Titles and subheadings in the form detect_person_names receives them
+FIXTURE_PAGE_HEADINGS = [
+  'The Quiet Revolution In Rural Schools. By Margaret Ellison',
+  'Letters From The Front. Words And Pictures By Thomas Okafor',
+  'A Year In The Garden. Sarah Lindqvist On Planting For Winter',
+  'Why The Bridge Fell. An Investigation By Daniel Reyes And Priya Natarajan',
+  'Interview: Jean-Luc Moreau On Forty Years Of Photography',
+  'The Long Road Home. Text By Aisling O\'Connor, Photographs By Kenji Watanabe',
+  'Editorial. A Note From The Editor, Helen Marsh',
+  'Tides Of Change. How Coastal Towns Are Adapting',
+]
+
+# Runs in a freshly spawned process, so that the peak resident memory is that of loading and running one backend alone
+def run_ner_backend(backend, texts, repeats):
+  import ner
+  baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  classifier = ner.load_ner_classifier(backend)
+  start = time.perf_counter()
+  for _ in range(repeats):
+    tags_per_text = [classifier(text) for text in texts]
+  latency = (time.perf_counter() - start) / (repeats * len(texts))
+  entities = [[tag['word'] for tag in tags if tag['entity_group']=='PER'] for tags in tags_per_text]
+  return latency, entities, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline_rss
+
+# The int8 model must find the same PER entities as the fp32 model, with its latency and peak memory reported alongside
+def benchmark_ner_backends(page_headings_path, repeats):
+  texts = open(page_headings_path, encoding='utf-8').read().splitlines() if page_headings_path else FIXTURE_PAGE_HEADINGS
+  entities = {}
+  for backend in ['fp32', 'int8']:
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+      latency, entities[backend], peak_rss_increase = executor.submit(run_ner_backend, backend, texts, repeats).result()
+    logging.info(f'{backend}: {latency * 1000:.1f}ms per page, peak RSS increase {peak_rss_increase / 1024:.0f} MB')
+
+  identical = entities['fp32'] == entities['int8']
+  logging.info(f'Same PER entities on {sum(a == b for a, b in zip(entities["fp32"], entities["int8"]))}/{len(texts)} pages')
+  return identical
+
+# Pages/sec of the row-wise and indexed initial capital merging, which must produce the same blocks and text
+def benchmark_initial_capitals(block_count, blocks_per_page, initial_caps_per_page):
+  from preprocessing import remove_initial_capitals
+  df = make_synthetic_initial_caps_df(block_count, blocks_per_page, initial_caps_per_page)
+  page_count = df.groupby(['pdf_file', 'page_number']).ngroups
+  rates = {}
+  for name, function in [('row-wise', remove_initial_capitals_rowwise), ('indexed', remove_initial_capitals)]:
+    start = time.perf_counter()
+    result = df.copy().groupby(['pdf_file', 'page_number'], group_keys=False).apply(function).sort_index()
+    rates[name] = (page_count / (time.perf_counter() - start), result)
+  rowwise_df, indexed_df = rates['row-wise'][1], rates['indexed'][1]
+  identical = rowwise_df.index.equals(indexed_df.index) and rowwise_df['text'].tolist() == indexed_df['text'].tolist()
+  logging.info(f'{blocks_per_page} blocks and {initial_caps_per_page} initial capitals per page: row-wise {rates["row-wise"][0]:,.1f} pages/sec, '
+    f'indexed {rates["indexed"][0]:,.1f} pages/sec, identical output: {identical}')
+  return identical
+
+# Word boundaries as character offsets into the unspaced text
+def word_boundaries(words):
+  boundaries, offset = set(), 0
+  for word in words:
+    offset += len(word)
+    boundaries.add(offset)
+  return boundaries
+
+# Time per block and accuracy against the reference spacing, of wordsegment (wrapped as in the pipeline) and the Viterbi segmenter
+def benchmark_segmentation(corpus_path, block_count):
+  from textwrap import wrap
+  import wordsegment
+  from segmentation import ViterbiSegmenter, non_alphanumeric
+  texts = open(corpus_path, encoding='utf-8').read().splitlines() if corpus_path else make_synthetic_segmentation_corpus(block_count)
+  references = [non_alphanumeric.sub(' ', text.lower()).split() for text in texts]
+  unspaced_texts = [''.join(words) for words in references]
+
+  wordsegment.load()
+  segmenter = ViterbiSegmenter.load(config['segmentation']['table_path'], config['segmentation']['max_word_length'])
+  max_limit = config['wordsegment_max_limit']
+  engines = {
+    'wordsegment': lambda s: [word for ss in (wrap(s, max_limit) if len(s) >= max_limit else [s]) for word in wordsegment.segment(ss)],
+    'viterbi': segmenter.segment
+  }
+  segmentations = {}
+  for name, segment in engines.items():
+    start = time.perf_counter()
+    segmentations[name] = [segment(text) for text in unspaced_texts]
+    elapsed = time.perf_counter() - start
+    exact = sum(words == reference for words, reference in zip(segmentations[name], references))
+    true_positives = predicted = actual = 0
+    for words, reference in zip(segmentations[name], references):
+      boundaries, reference_boundaries = word_boundaries(words), word_boundaries(reference)
+      true_positives += len(boundaries & reference_boundaries)
+      predicted += len(boundaries)
+      actual += len(reference_boundaries)
+    f1 = 2 * true_positives / max(1, predicted + actual)
+    logging.info(f'{name}: {elapsed / len(texts) * 1000:.1f}ms per block, {exact}/{len(texts)} blocks segmented exactly, '
+      f'word boundary F1 {f1:.4f}')
+  agreeing = sum(a == b for a, b in zip(segmentations['wordsegment'], segmentations['viterbi']))
+  logging.info(f'Engines agree on {agreeing}/{len(texts)} blocks')
+  return segmentations
+
+HEAVY_MODULES = ['torch', 'transformers', 'layoutparser', 'detectron2', 'jamspell', 'wordsegment']
+
+# Runs in a fresh interpreter, as nothing may be imported before the clock starts
+# The first page is the first page of text blocks out of OCR, which is when its models are loaded unless warmed up beforehand
+def measure_startup(pdf_file_path, warm_up):
+  code = f'''import time
+start = time.perf_counter()
+import json
+import sys
+sys.path.insert(0, {str(Path(__file__).parent)!r})
+import main
+import_time = time.perf_counter() - start
+heavy_modules = [name for name in {HEAVY_MODULES!r} if name in sys.modules]
+import ner, ocr, preprocessing
+if {warm_up!r}:
+  ocr.init_models()
+  preprocessing.init_models()
+  ner.init_models()
+warm_up_time = time.perf_counter() - start - import_time
+next(ocr.pdf_to_page_dfs({str(pdf_file_path)!r}, 1))
+print(json.dumps({{'import_s': import_time, 'warm_up_s': warm_up_time, 'first_page_s': time.perf_counter() - start,
+  'heavy_modules_imported': heavy_modules}}))'''
+  output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+  return json.loads(output.splitlines()[-1])
+
+# Time to import main, and time from the start of the process to the first OCR'd page, with models loaded lazily or warmed up
+def benchmark_startup(pdf_file_path, repeats):
+  with tempfile.TemporaryDirectory() as tmp_dir:
+    if not pdf_file_path:
+      pdf_file_path = Path(tmp_dir) / 'synthetic_1.pdf'
+      make_synthetic_pdf(pdf_file_path, 1, dpi=150)
+    results = {}
+    for warm_up in [False, True]:
+      runs = [measure_startup(pdf_file_path, warm_up) for _ in range(repeats)]
+      results[warm_up] = {key: min(run[key] for run in runs) for key in ['import_s', 'warm_up_s', 'first_page_s']}
+      logging.info(f'{"Warmed up" if warm_up else "Lazy"}: import main {results[warm_up]["import_s"]:.2f}s, '
+        f'warm-up {results[warm_up]["warm_up_s"]:.2f}s, first page after {results[warm_up]["first_page_s"]:.2f}s; '
+        f'heavy modules imported with main: {runs[0]["heavy_modules_imported"] or "none"}')
+  return results
+
+# A stand-in client: copies the PDF into incoming under a temporary name, renames it, and polls its status until it finishes
+def submit_job_and_wait(spool_dir, pdf_file_path, job_id, timeout):
+  from service import read_status, spool_paths
+  incoming = spool_paths(spool_dir)['incoming']
+  start = time.perf_counter()
+  shutil.copy(pdf_file_path, incoming / f'{job_id}.pdf.part')
+  os.replace(incoming / f'{job_id}.pdf.part', incoming / f'{job_id}.pdf')
+  while time.perf_counter() - start < timeout:
+    status = read_status(spool_dir, job_id)
+    if status and status['state'] in ['done', 'failed']:
+      return time.perf_counter() - start, status['state']
+    time.sleep(0.05)
+  raise TimeoutError(f'Job {job_id} did not finish within {timeout}s')
+
+# Latency of a job submitted as the service starts (its worker has to start and load every model) against jobs on warm workers
+def benchmark_service_latency(pdf_file_path, warm_jobs, timeout):
+  from service import Service
+  with tempfile.TemporaryDirectory() as tmp_dir:
+    if not pdf_file_path:
+      pdf_file_path = Path(tmp_dir) / 'synthetic_2.pdf'
+      make_synthetic_pdf(pdf_file_path, 2, dpi=150)
+    spool_dir = Path(tmp_dir) / 'spool'
+    config['checkpoints']['enabled'] = False # every job must run the pipeline, not read back the first job's checkpoints
+    service = Service(spool_dir, workers=1)
+    service_thread = threading.Thread(target=service.serve_forever)
+    service_thread.start()
+    try:
+      cold_latency, cold_state = submit_job_and_wait(spool_dir, pdf_file_path, 'cold', timeout)
+      warm_results = [submit_job_and_wait(spool_dir, pdf_file_path, f'warm_{i}', timeout) for i in range(warm_jobs)]
+    finally:
+      service.stop()
+      service_thread.join()
+
+  warm_latencies = [latency for latency, _ in warm_results]
+  all_done = cold_state == 'done' and all(state == 'done' for _, state in warm_results)
+  logging.info(f'Cold worker: {cold_latency:.1f}s, warm workers: {sum(warm_latencies) / len(warm_latencies):.1f}s mean '
+    f'({min(warm_latencies):.1f}s-{max(warm_latencies):.1f}s over {len(warm_latencies)} jobs), all jobs done: {all_done}')
+  return all_done
+
+# A checkpointed frame must load back identical to the frame saved, including dtypes, and is compared with a pickle in size and load time
+def benchmark_checkpoints(blocks_df_path, block_count):
+  import pandas
+  from checkpoints import load_frame, save_frame
+  from detect_page_layout import detect_page_layout
+  from detect_structure_elements import remove_headers_footers, classify_heading_type
+  df = detect_page_layout(classify_heading_type(remove_headers_footers(load_blocks_df(blocks_df_path, block_count))))
+  with tempfile.TemporaryDirectory() as tmp_dir:
+    pickle_path, parquet_path = Path(tmp_dir) / 'frame.pkl', Path(tmp_dir) / 'frame.parquet'
+    df.to_pickle(pickle_path)
+    start = time.perf_counter()
+    save_frame(df, parquet_path)
+    save_time = time.perf_counter() - start
+    start = time.perf_counter()
+    pandas.read_pickle(pickle_path)
+    pickle_load_time = time.perf_counter() - start
+    start = time.perf_counter()
+    loaded_df = load_frame(parquet_path)
+    parquet_load_time = time.perf_counter() - start
+    pickle_size, parquet_size = pickle_path.stat().st_size, parquet_path.stat().st_size
+    stored_dtypes = pandas.read_parquet(parquet_path).dtypes.astype(str).to_dict()
+
+  identical = df.equals(loaded_df) and df.dtypes.equals(loaded_df.dtypes)
+  logging.info(f'{len(df):,} blocks: pickle {pickle_size / 2**20:.1f} MB loaded in {pickle_load_time:.2f}s, '
+    f'Parquet {parquet_size / 2**20:.1f} MB saved in {save_time:.2f}s and loaded in {parquet_load_time:.2f}s, identical after loading: {identical}')
+  logging.info(f'Stored dtypes: {stored_dtypes}')
+  return identical
+
+def main():
+  logging.basicConfig(level=logging.INFO)
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+  parallel_ocr = subparsers.add_parser('parallel_ocr', help='serial vs process-pool OCR parity and timing')
+  parallel_ocr.add_argument('pdf_file_path')
+  parallel_ocr.add_argument('--workers', type=int, default=config['ocr']['parallel']['workers'])
+
+  batched_layout = subparsers.add_parser('batched_layout', help='per-page vs batched Detectron2 layout detection')
+  batched_layout.add_argument('pdf_file_path')
+  batched_layout.add_argument('--batch-size', type=int, default=config['detectron2']['batch_size'])
+  batched_layout.add_argument('--max-pages', type=int, default=32)
+
+  ocr_engine = subparsers.add_parser('ocr_engine', help='per-crop vs persistent Tesseract accuracy and timing')
+  ocr_engine.add_argument('pdf_file_path')
+  ocr_engine.add_argument('--max-pages', type=int, default=8)
+
+  render = subparsers.add_parser('render', help='PNG round-trip vs direct grayscale page rendering')
+  render.add_argument('pdf_file_path')
+  render.add_argument('--max-pages', type=int, default=16)
+
+  thresholding = subparsers.add_parser('thresholding', help='standard vs fast image enhancement pixel agreement and timing')
+  thresholding.add_argument('pdf_file_path')
+  thresholding.add_argument('--max-pages', type=int, default=8)
+  thresholding.add_argument('--downsample', type=int, nargs='+', default=[1, 2, 4, 8])
+
+  multi_resolution = subparsers.add_parser('multi_resolution', help='full-resolution vs multi-resolution OCR CPU time and memory')
+  multi_resolution.add_argument('pdf_file_path')
+  multi_resolution.add_argument('--max-pages', type=int, default=8)
+
+  streaming_memory = subparsers.add_parser('streaming_memory', help='peak memory of whole-document vs streaming pipeline on synthetic PDFs')
+  streaming_memory.add_argument('--page-counts', type=int, nargs='+', default=[250, 500, 1000])
+
+  page_layout = subparsers.add_parser('page_layout', help='row-wise vs vectorised column layout assignment')
+  page_layout.add_argument('--blocks-df', help='pickled DataFrame of text blocks, e.g. the labelled dataset (default: synthetic blocks)')
+  page_layout.add_argument('--blocks', type=int, default=21000)
+
+  structure_elements = subparsers.add_parser('structure_elements', help='row-wise vs columnar heading classification')
+  structure_elements.add_argument('--blocks-df', help='pickled DataFrame of text blocks (default: synthetic blocks)')
+  structure_elements.add_argument('--blocks', type=int, default=100000)
+
+  batched_ner = subparsers.add_parser('batched_ner', help='per-page vs batched NER author detection')
+  batched_ner.add_argument('classified_df_path', help='pickled DataFrame after classify_heading_type and detect_page_layout')
+
+  author_names = subparsers.add_parser('author_names', help='linear-scan vs indexed fuzzy author name matching')
+  author_names.add_argument('--names', type=int, default=50000)
+  author_names.add_argument('--queries', type=int, default=500)
+
+  ner_backends = subparsers.add_parser('ner_backends', help='fp32 vs int8 NER entity parity, latency and peak memory')
+  ner_backends.add_argument('--page-headings', help='text file with one page\'s headings per line (default: built-in fixtures)')
+  ner_backends.add_argument('--repeats', type=int, default=5)
+
+  segmentation = subparsers.add_parser('segmentation', help='wordsegment vs Viterbi word segmentation speed and accuracy')
+  segmentation.add_argument('--corpus', help='text file of correctly spaced text, one block per line (default: synthetic blocks)')
+  segmentation.add_argument('--blocks', type=int, default=500)
+
+  initial_capitals = subparsers.add_parser('initial_capitals', help='row-wise vs indexed initial capital merging')
+  initial_capitals.add_argument('--blocks', type=int, default=20000)
+  initial_capitals.add_argument('--blocks-per-page', type=int, default=400)
+  initial_capitals.add_argument('--initial-caps-per-page', type=int, default=20)
+
+  checkpoints = subparsers.add_parser('checkpoints', help='round trip, size and load time of a checkpointed stage output vs a pickle')
+  checkpoints.add_argument('--blocks-df', help='pickled DataFrame of text blocks (default: synthetic blocks)')
+  checkpoints.add_argument('--blocks', type=int, default=100000)
+
+  startup = subparsers.add_parser('startup', help='import time of main and time to the first OCR\'d page, lazy vs warmed-up models')
+  startup.add_argument('--pdf', help='PDF whose first page is OCR\'d (default: a synthetic scanned page)')
+  startup.add_argument('--repeats', type=int, default=3)
+
+  service_latency = subparsers.add_parser('service_latency', help='service job latency on cold vs warm workers, via a stand-in client')
+  service_latency.add_argument('--pdf', help='PDF submitted as each job (default: two synthetic scanned pages)')
+  service_latency.add_argument('--warm-jobs', type=int, default=3)
+  service_latency.add_argument('--timeout', type=float, default=600)
+
+  args = parser.parse_args()
+  if args.benchmark == 'parallel_ocr':
+    if not check_parallel_ocr_parity(args.pdf_file_path, max(2, args.workers)):
+      raise SystemExit(1)
+  elif args.benchmark == 'batched_layout':
+    benchmark_batched_layout(args.pdf_file_path, args.batch_size, args.max_pages)
+  elif args.benchmark == 'ocr_engine':
+    check_ocr_engine_parity(args.pdf_file_path, args.max_pages)
+  elif args.benchmark == 'render':
+    benchmark_render(args.pdf_file_path, args.max_pages)
+  elif args.benchmark == 'thresholding':
+    benchmark_thresholding(args.pdf_file_path, args.max_pages, args.downsample)
+  elif args.benchmark == 'multi_resolution':
+    benchmark_multi_resolution(args.pdf_file_path, args.max_pages)
+  elif args.benchmark == 'streaming_memory':
+    benchmark_streaming_memory(args.page_counts)
+  elif args.benchmark == 'page_layout':
+    if not benchmark_page_layout(args.blocks_df, args.blocks):
+      raise SystemExit(1)
+  elif args.benchmark == 'structure_elements':
+    if not benchmark_structure_elements(args.blocks_df, args.blocks):
+      raise SystemExit(1)
+  elif args.benchmark == 'batched_ner':
+    if not benchmark_batched_ner(args.classified_df_path):
+      raise SystemExit(1)
+  elif args.benchmark == 'author_names':
+    if not benchmark_author_name_matching(args.names, args.queries):
+      raise SystemExit(1)
+  elif args.benchmark == 'ner_backends':
+    if not benchmark_ner_backends(args.page_headings, args.repeats):
+      raise SystemExit(1)
+  elif args.benchmark == 'segmentation':
+    benchmark_segmentation(args.corpus, args.blocks)
+  elif args.benchmark == 'service_latency':
+    if not benchmark_service_latency(args.pdf, args.warm_jobs, args.timeout):
+      raise SystemExit(1)
+  elif args.benchmark == 'checkpoints':
+    if not benchmark_checkpoints(args.blocks_df, args.blocks):
+      raise SystemExit(1)
+  elif args.benchmark == 'startup':
+    benchmark_startup(args.pdf, args.repeats)
+  elif args.benchmark == 'initial_capitals':
+    if not benchmark_initial_capitals(args.blocks, args.blocks_per_page, args.initial_caps_per_page):
+      raise SystemExit(1)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,191 @@
+"""
+Stage-level benchmark suite, to catch performance regressions before they reach production
+Synthetic magazine-style PDFs are generated with PyMuPDF (2, 3 or 4 columns, headers, footers, titles, bylines and initial capitals),
+then rasterised, so that every page is "scanned" and goes through OCR.
+Each stage of the pipeline is timed at several document sizes, and the results are saved as JSON and compared against a baseline.
+Runs offline on CPU: models which cannot be loaded are replaced by stubs, and each stage is only compared against a baseline
+which ran it the same way (real, stub or skipped).
+Run from the repository root, e.g.
+  python src/benchmark_suite.py --sizes 4 16 64 --baseline results/benchmarks/baseline.json
+"""
+
+import argparse
+import json
+import logging
+import platform
+import re
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+import pandas
+
+from synthetic import make_synthetic_pdf
+from utils import load_config
+
+config = load_config()
+
+# Stands in for Detectron2 and Tesseract by returning the generator's ground truth, in the same columns as pdf_to_ocr_scanned_df
+def ocr_stub(pages_text_blocks):
+  df = pandas.DataFrame([text_block for text_blocks in pages_text_blocks for text_block in text_blocks])
+  df['centre_x'] = (df['left'] + df['right']) // 2
+  df['centre_y'] = (df['bottom'] + df['top']) // 2
+  return df
+
+class IdentitySpellChecker:
+  def FixFragment(self, text):
+    return text
+
+# Tags the name in a 'By <name>' byline, in the output format of the transformers NER pipeline
+def ner_classifier_stub(texts, batch_size=None):
+  return [[{'entity_group': 'PER', 'word': name} for name in re.findall(r'By ([A-Z]\w+ [A-Z]\w+)', text)] for text in texts]
+
+# Loads each stage's models once, before any timing, and records whether the stage runs for real, with stubs, or not at all
+def prepare_stages():
+  import registry
+  modes = {}
+  try:
+    import ocr
+    import ocr_cache
+    ocr_cache.config['ocr_cache']['enabled'] = False # every size must run OCR, not read it back
+    ocr.init_models()
+    if registry.get('layout_detecting_model') is None or shutil.which('tesseract') is None:
+      raise RuntimeError('Detectron2 layout model or Tesseract unavailable')
+    modes['ocr'] = 'real'
+  except Exception as e:
+    logging.warning(f'OCR stubbed with the ground truth text blocks: {e}')
+    modes['ocr'] = 'stub'
+
+  try:
+    import preprocessing
+    modes['preprocessing'] = 'real'
+    if not Path(config['jamspell_language_model']).exists():
+      logging.warning(f"JamSpell language model {config['jamspell_language_model']} not found, spell checking stubbed")
+      registry.override('spell_checker', IdentitySpellChecker())
+      preprocessing.config['preprocessing']['workers'] = 1 # pool workers would load the missing model themselves
+      modes['preprocessing'] = 'stub'
+    preprocessing.init_models()
+  except Exception as e:
+    logging.warning(f'Preprocessing skipped: {e}')
+    modes['preprocessing'] = 'skipped'
+
+  try:
+    import ner
+    modes['detect_authors'] = 'real'
+    for name, stub in [('ner_classifier', ner_classifier_stub), ('author_names', (ner.Trie({}), ner.AuthorNamesIndex([])))]:
+      try:
+        registry.get(name)
+      except Exception as e:
+        logging.warning(f'{name} unavailable, stubbed: {e}')
+        registry.override(name, stub)
+        modes['detect_authors'] = 'stub'
+  except Exception as e:
+    logging.warning(f'Author detection skipped: {e}')
+    modes['detect_authors'] = 'skipped'
+  return modes
+
+def write_output(df, output_dir):
+  from output_format import df_to_formatted_docx
+  df = df.sort_values(by=['pdf_file', 'page_number', 'heading_type', 'column_position', 'centre_y'])
+  df.groupby('pdf_file').apply(df_to_formatted_docx, str(output_dir))
+  return df
+
+def run_stages(pdf_file_path, pages_text_blocks, output_dir, modes):
+  from detect_structure_elements import remove_headers_footers, classify_heading_type
+  from detect_page_layout import detect_page_layout
+  timings = {}
+  def timed(name, function, *args):
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    result = function(*args)
+    timings[name] = {'wall_s': time.perf_counter() - start_wall, 'cpu_s': time.process_time() - start_cpu, 'mode': modes.get(name, 'real')}
+    return result
+
+  if modes['ocr'] == 'real':
+    from ocr import pdf_to_ocr_scanned_df
+    df = timed('ocr', pdf_to_ocr_scanned_df, pdf_file_path, 1)
+  else:
+    df = timed('ocr', ocr_stub, pages_text_blocks)
+  if modes['preprocessing'] != 'skipped':
+    from preprocessing import preprocessing
+    df = timed('preprocessing', preprocessing, df)
+  df = timed('remove_headers_footers', remove_headers_footers, df)
+  df = timed('classify_heading_type', classify_heading_type, df)
+  df = timed('detect_page_layout', detect_page_layout, df)
+  if modes['detect_authors'] != 'skipped':
+    from ner import detect_authors
+    df = timed('detect_authors', detect_authors, df)
+  else:
+    df = df.assign(author='')
+  timed('df_to_formatted_docx', write_output, df, output_dir)
+  return timings
+
+# The fastest of several repeats is kept for each stage, as the least disturbed by other load on the machine
+def run_suite(sizes, repeats, dpi):
+  modes = prepare_stages()
+  results = {'created': time.strftime('%Y-%m-%d %H:%M:%S'), 'python': platform.python_version(), 'machine': platform.machine(),
+    'dpi': dpi, 'modes': modes, 'sizes': {}}
+  with tempfile.TemporaryDirectory() as tmp_dir:
+    for page_count in sizes:
+      pdf_file_path = Path(tmp_dir) / f'synthetic_{page_count}.pdf'
+      pages_text_blocks = make_synthetic_pdf(pdf_file_path, page_count, dpi)
+      size_results = {}
+      for _ in range(repeats):
+        for name, timing in run_stages(pdf_file_path, pages_text_blocks, tmp_dir, modes).items():
+          if name not in size_results or timing['wall_s'] < size_results[name]['wall_s']:
+            size_results[name] = timing
+      for name, timing in size_results.items():
+        timing['wall_s_per_page'] = timing['wall_s'] / page_count
+        logging.info(f"{page_count} pages, {name} ({timing['mode']}): {timing['wall_s']:.2f}s wall, {timing['cpu_s']:.2f}s CPU, "
+          f"{timing['wall_s_per_page'] * 1000:.1f}ms per page")
+      results['sizes'][str(page_count)] = size_results
+  return results
+
+# A stage regresses when it is more than tolerance (a fraction) slower than the baseline, and by more than min_delta seconds,
+# so that noise in stages taking a few milliseconds is not reported
+def compare_with_baseline(results, baseline, tolerance, min_delta):
+  regressions = []
+  for size, size_results in results['sizes'].items():
+    for name, timing in size_results.items():
+      baseline_timing = baseline['sizes'].get(size, {}).get(name)
+      if baseline_timing is None or baseline_timing['mode'] != timing['mode']:
+        logging.info(f'{size} pages, {name}: no comparable baseline')
+        continue
+      change = timing['wall_s'] / max(baseline_timing['wall_s'], 1e-9) - 1
+      regressed = change > tolerance and timing['wall_s'] - baseline_timing['wall_s'] > min_delta
+      logging.log(logging.WARNING if regressed else logging.INFO,
+        f"{size} pages, {name}: {timing['wall_s']:.2f}s vs baseline {baseline_timing['wall_s']:.2f}s ({change:+.0%})"
+        f"{' REGRESSION' if regressed else ''}")
+      if regressed:
+        regressions.append((size, name, change))
+  return regressions
+
+def main():
+  logging.basicConfig(level=logging.INFO)
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--sizes', type=int, nargs='+', default=[4, 16, 64], help='document sizes, in pages')
+  parser.add_argument('--repeats', type=int, default=1)
+  parser.add_argument('--dpi', type=int, default=150, help='resolution at which the synthetic pages are rasterised')
+  parser.add_argument('--output', help='JSON results file (default: results/benchmarks/suite-<time>.json)')
+  parser.add_argument('--baseline', help='JSON results of an earlier run to compare against')
+  parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown against the baseline, as a fraction')
+  parser.add_argument('--min-delta', type=float, default=0.05, help='slowdowns of fewer seconds than this are ignored')
+  args = parser.parse_args()
+
+  results = run_suite(args.sizes, args.repeats, args.dpi)
+  output_path = Path(args.output or Path(config['output_dir']) / 'benchmarks' / f"suite-{time.strftime('%Y%m%d-%H%M%S')}.json")
+  output_path.parent.mkdir(parents=True, exist_ok=True)
+  with open(output_path, 'w', encoding='utf-8') as f:
+    json.dump(results, f, indent=2)
+  logging.info(f'Results saved to {output_path}')
+
+  if args.baseline:
+    with open(args.baseline, encoding='utf-8') as f:
+      baseline = json.load(f)
+    regressions = compare_with_baseline(results, baseline, args.tolerance, args.min_delta)
+    if regressions:
+      logging.error(f'{len(regressions)} stages slower than the baseline by more than {args.tolerance:.0%}')
+      raise SystemExit(1)
+
+if __name__ == "__main__":
+  main()
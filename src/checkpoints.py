@@ -0,0 +1,213 @@
+"""
+Checkpoints of each stage's output DataFrame, so that an interrupted run resumes where it stopped,
+and a re-run after a config change recomputes only the stages that the change affects.
+Artifacts are keyed on a hash of the input PDF, chained through the hashes of the config sections and data files each stage
+depends on, so changing e.g. detect_structure invalidates structure, layout and NER, but reuses the OCR and preprocessing outputs.
+OCR is also checkpointed page by page, so that a run killed part way through a PDF resumes at its first missing page.
+Frames are stored as Parquet with compact dtypes, and written to a temporary file and renamed, so a partial write is never read.
+The least-recently-used artifacts are evicted once the checkpoints exceed their size cap.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+from functools import lru_cache
+from pathlib import Path
+
+import pandas
+
+from utils import load_config
+
+config = load_config()
+
+# Config sections each stage's output depends on, besides the output of the stage before it
+# Scheduling settings (workers, batch sizes, caches) do not change results, so they are left out
+STAGE_CONFIG_SECTIONS = {
+  'ocr': ['ocr', 'detectron2', 'tesseract_data_dir'],
+  'preprocessing': ['segmentation', 'wordsegment_max_limit', 'jamspell_language_model', 'paragraph_break_placeholder'],
+  'structure': ['detect_structure'],
+  'layout': ['column_centres', 'assign_column', 'unsorted_column_value'],
+  'ner': ['ner', 'author_names_filepath'],
+}
+SCHEDULING_KEYS = {
+  'ocr': ['parallel'],
+  'detectron2': ['batch_size'],
+  'ner': ['batch_size', 'match_cache_size'],
+}
+
+# Config paths of the data files and model directories each stage reads, whose contents are hashed into its key,
+# so that replacing e.g. author_names.pkl at the same path invalidates the stage
+# Paths that do not exist locally (e.g. a Hugging Face model id, or an lp:// model) are keyed on their config value alone
+STAGE_DATA_FILES = {
+  'ocr': [['tesseract_data_dir']],
+  'preprocessing': [['jamspell_language_model']],
+  'ner': [['author_names_filepath'], ['ner', 'model_name']],
+}
+
+# Stored as the smallest integer dtype that fits, and restored to int64 on load, as e.g. block areas overflow int16
+INT_COLUMNS = ['left', 'top', 'bottom', 'right', 'centre_x', 'centre_y', 'page_number', 'heading_type', 'column_position']
+
+def is_enabled():
+  return config['checkpoints']['enabled']
+
+def file_hash(file_path):
+  digest = hashlib.sha256()
+  with open(file_path, 'rb') as f:
+    for chunk in iter(lambda: f.read(1 << 20), b''):
+      digest.update(chunk)
+  return digest.hexdigest()
+
+# Memoised on the file's size and modification time, so large models are only read once per process
+@lru_cache(maxsize=None)
+def cached_file_hash(file_path, size, mtime_ns):
+  return file_hash(file_path)
+
+def data_hash(path):
+  path = Path(path)
+  if not path.exists():
+    return None
+  file_paths = sorted(p for p in path.rglob('*') if p.is_file()) if path.is_dir() else [path]
+  digest = hashlib.sha256()
+  for file_path in file_paths:
+    stat = file_path.stat()
+    digest.update(f'{file_path.relative_to(path) if path.is_dir() else file_path.name}:'.encode())
+    digest.update(cached_file_hash(str(file_path), stat.st_size, stat.st_mtime_ns).encode())
+  return digest.hexdigest()
+
+def config_value(keys):
+  value = config
+  for key in keys:
+    value = value.get(key) if isinstance(value, dict) else None
+  return value
+
+def stage_hash(stage):
+  stage_config = {}
+  for section in STAGE_CONFIG_SECTIONS[stage]:
+    value = config.get(section)
+    if isinstance(value, dict):
+      value = {k: v for k, v in value.items() if k not in SCHEDULING_KEYS.get(section, [])}
+    stage_config[section] = value
+  data_hashes = {'.'.join(keys): data_hash(config_value(keys)) for keys in STAGE_DATA_FILES.get(stage, []) if config_value(keys)}
+  return hashlib.sha256(json.dumps({'config': stage_config, 'data': data_hashes}, sort_keys=True, default=str).encode()).hexdigest()
+
+def compact_dtypes(df):
+  df = df.copy()
+  for column in df.columns.intersection(INT_COLUMNS):
+    df[column] = pandas.to_numeric(df[column], downcast='integer')
+  if 'pdf_file' in df.columns:
+    df['pdf_file'] = df['pdf_file'].astype(str).astype('category')
+  return df
+
+# pdf_file is restored to strings, as grouping on a category would also produce groups for unobserved values
+def restore_dtypes(df):
+  for column in df.columns.intersection(INT_COLUMNS):
+    df[column] = df[column].astype('int64')
+  if 'pdf_file' in df.columns:
+    df['pdf_file'] = df['pdf_file'].astype(object)
+  return df
+
+def save_frame(df, path):
+  tmp_path = path.with_name(f'.{path.name}.tmp')
+  compact_dtypes(df).to_parquet(tmp_path, engine='pyarrow')
+  os.replace(tmp_path, path)
+
+def load_frame(path):
+  return restore_dtypes(pandas.read_parquet(path, engine='pyarrow'))
+
+def artifact_size(path):
+  if path.is_dir():
+    return sum(p.stat().st_size for p in path.iterdir())
+  return path.stat().st_size
+
+# Artifacts are stage frames and per-page OCR directories; a frame's modification time is refreshed whenever it is read,
+# and a directory's whenever a page is added to it
+# The artifact just written is kept, even if it alone is over the cap
+def evict(checkpoints_dir, keep_path):
+  max_size = config['checkpoints']['max_size_mb'] * 1024 * 1024
+  artifacts = []
+  for path in checkpoints_dir.iterdir():
+    try:
+      artifacts.append((path.stat().st_mtime, artifact_size(path), path))
+    except FileNotFoundError: # removed by another process meanwhile
+      continue
+  total_size = sum(size for _, size, _ in artifacts)
+  for _, size, path in sorted(artifacts, key=lambda artifact: artifact[0]):
+    if total_size <= max_size:
+      break
+    if path == keep_path or path.name.startswith('.'):
+      continue
+    if path.is_dir():
+      shutil.rmtree(path, ignore_errors=True)
+    else:
+      path.unlink(missing_ok=True)
+    total_size -= size
+    logging.info(f'Evicted checkpoint {path}')
+
+class PipelineCheckpoints:
+  def __init__(self, pdf_file_path):
+    self.pdf_file_path = pdf_file_path
+    self.pdf_filename = Path(pdf_file_path).stem
+    self.dir = Path(config['checkpoints']['dir'])
+    self.key = file_hash(pdf_file_path) if is_enabled() else None
+
+  def artifact_path(self, stage, key=None):
+    return self.dir / f'{self.pdf_filename}-{stage}-{(key or self.key)[:16]}.parquet'
+
+  def next_key(self, stage):
+    return hashlib.sha256((self.key + stage_hash(stage)).encode()).hexdigest()
+
+  # Whether the output of the next stage to be run is already saved, so that its inputs need not be prepared
+  def is_saved(self, stage):
+    return is_enabled() and self.artifact_path(stage, self.next_key(stage)).exists()
+
+  def pages_dir(self):
+    return self.artifact_path('ocr').with_suffix('.pages')
+
+  # Stages must be run in pipeline order, as each stage's key is chained from the key of the stage before it
+  def run(self, stage, function, *args, **kwargs):
+    if not is_enabled():
+      return function(*args, **kwargs)
+    self.key = self.next_key(stage)
+    path = self.artifact_path(stage)
+    if path.exists():
+      try:
+        df = load_frame(path)
+        os.utime(path) # marks the artifact as recently used, for eviction
+        logging.info(f'{self.pdf_filename}: {stage} resumed from {path}')
+        return df
+      except Exception as e:
+        logging.warning(f'{self.pdf_filename}: unreadable {stage} checkpoint {path} is recomputed: {e}')
+    df = function(*args, **kwargs)
+    self.dir.mkdir(parents=True, exist_ok=True)
+    save_frame(df, path)
+    if stage == 'ocr':
+      shutil.rmtree(self.pages_dir(), ignore_errors=True)
+    evict(self.dir, path)
+    return df
+
+  # Run as the 'ocr' stage: each page is saved as soon as it is read, and pages saved by an earlier run are not read again
+  def ocr(self):
+    from ocr import load_fitz_file, page_dfs_to_df, pdf_to_page_dfs
+    if not is_enabled():
+      from ocr import pdf_to_ocr_scanned_df
+      return pdf_to_ocr_scanned_df(self.pdf_file_path)
+    pages_dir = self.pages_dir()
+    pages_dir.mkdir(parents=True, exist_ok=True)
+    pdf_file = load_fitz_file(self.pdf_file_path)
+    page_count = pdf_file.page_count
+    pdf_file.close()
+
+    page_paths = [pages_dir / f'page_{page_number}.parquet' for page_number in range(page_count)]
+    remaining_page_numbers = [page_number for page_number, page_path in enumerate(page_paths) if not page_path.exists()]
+    if len(remaining_page_numbers) < page_count:
+      logging.info(f'{self.pdf_filename}: OCR resumed, {page_count - len(remaining_page_numbers)} of {page_count} pages already read')
+    # The generator comes first, so that it is run to its end and closes its process pool and the PDF
+    page_dfs = pdf_to_page_dfs(self.pdf_file_path, page_numbers=remaining_page_numbers)
+    for page_df, page_number in zip(page_dfs, remaining_page_numbers):
+      save_frame(page_df, page_paths[page_number])
+    return page_dfs_to_df([load_frame(page_path) for page_path in page_paths])
+
+def clear():
+  shutil.rmtree(config['checkpoints']['dir'], ignore_errors=True)
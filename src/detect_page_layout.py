@@ -11,39 +11,38 @@ Uses statistical analysis of a hand-labelled dataset (N = 21,000) to determine c
 """
 
 
+import numpy as np
+import pandas
+
 from utils import load_config
 
 config = load_config()
 column_centres = config['column_centres']
-col_width_margins = config['assign_column']
-UNSORTED_COLUMN_VALUE = 10
+col_width_margins = config['assign_column'] # [left-hand margin, column spacing] for each layout
 
 
 #'Centre' = X-coordinate of centre of text-box
 #Firstly subtracts the left-hand margin (e.g. 30 pixels), 
 #Then divides by spacing of columns (e.g. 210px for 2-columns, 130 for 3-cols)
+#Operates on whole arrays of centres at once
 assign_column = {
-  'double_col': lambda centre: min(1, centre//col_width_margins['double_col_width']),
-  'triple_col': lambda centre: min(2, (centre-col_width_margins['triple_col_margin'])//col_width_margins['triple_col_width']),
-  'quadruple_col': lambda centre: min(3, (centre-col_width_margins['quadruple_col_margin'])//col_width_margins['quadruple_col_width'])
+  'double_col': lambda centre: np.minimum(1, centre//col_width_margins['double_col'][1]),
+  'triple_col': lambda centre: np.minimum(2, (centre-col_width_margins['triple_col'][0])//col_width_margins['triple_col'][1]),
+  'quadruple_col': lambda centre: np.minimum(3, (centre-col_width_margins['quadruple_col'][0])//col_width_margins['quadruple_col'][1])
 }
 
 
-def assign_layout_ordering_to_page_df(page_df):
-  error = {layout: 0 for layout in column_centres.keys()}
-  for layout in column_centres.keys():
-    page_df[layout] = UNSORTED_COLUMN_VALUE
-
-  for i,text_block in page_df.iterrows():
-    for layout in column_centres.keys():
-      predicted_column = assign_column[layout](text_block['centre_x'])
-      page_df.at[i, layout] = predicted_column
-      error[layout] += abs(text_block['centre_x'] - column_centres[layout][predicted_column])
-
-  best_layout = sorted(error, key=error.get)[0]
-  page_df['column_position'] = page_df[best_layout]
-  return page_df.drop(column_centres.keys(), axis=1)
-
+# Predicts every block's column under every layout in one array operation, sums each page's positioning error per layout,
+# then assigns each page's blocks to the columns of the layout with the least error (ties go to the first layout)
 def detect_page_layout(df):
-  df = df.groupby(['pdf_file','page_number'], group_keys=False).apply(assign_layout_ordering_to_page_df)
-  return df
+  layouts = list(column_centres.keys())
+  centre_x = df['centre_x'].to_numpy()
+  predicted_columns = np.column_stack([assign_column[layout](centre_x) for layout in layouts])
+  errors = np.column_stack([
+    np.abs(centre_x - np.asarray(column_centres[layout])[predicted_columns[:, i]]) for i, layout in enumerate(layouts)
+  ])
+  page_errors = pandas.DataFrame(errors).groupby([df['pdf_file'].to_numpy(), df['page_number'].to_numpy()]).transform('sum')
+  best_layout = page_errors.to_numpy().argmin(axis=1)
+
+  df = df.assign(column_position=predicted_columns[np.arange(len(df)), best_layout])
+  return df.sort_values(by=['pdf_file', 'page_number'], kind='stable') # grouped by page, as before
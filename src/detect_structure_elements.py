@@ -10,46 +10,86 @@ than the average for each page, AND larger than average across the entire PDF.
 The latter is calculated using the PDF's standard deviation, because PDF differ widely in their variance of font-size.
 """
 
+import numpy as np
+
 from utils import load_config
 
 config_struct = load_config()['detect_structure']
 
 def remove_headers_footers(df):
-  is_not_header_or_footer = lambda row: all(row['top']<=config_struct['header_cutoff'], row['bottom']>=config_struct['footer_cutoff'])
-  df = df[df.apply(is_not_header_or_footer, axis=1)]
-  return df
+  is_not_header_or_footer = (df['top'] <= config_struct['header_cutoff']) & (df['bottom'] >= config_struct['footer_cutoff'])
+  return df[is_not_header_or_footer]
 
 # Font-size calculated by dividing text-box area by text-length (assuming the text fills the text-box equally)
-def compute_font_size(row):
-  return ((row['right'] - row['left']) * (row['bottom'] - row['top'])) // max(1, len(row['text']))
+def compute_font_size(df):
+  return ((df['right'] - df['left']) * (df['bottom'] - df['top'])) // df['text'].str.len().clip(lower=1)
+
+# Average font size of each group (e.g. page or PDF), weighted by the number of characters in each text box
+def compute_weighted_font_size_avg(df, group_by):
+  sums = df.assign(weighted_font_size=df['font_size'] * df['text'].str.len(), chars=df['text'].str.len()) \
+    .groupby(group_by)[['weighted_font_size', 'chars']].transform('sum')
+  return sums['weighted_font_size'] // sums['chars'].clip(lower=1)
 
 def compute_pdf_font_stats(df):
-  chars_per_text_box = df['text'].apply(len)
-  weighted_avg = ( df['font_size'] * chars_per_text_box ).sum() // chars_per_text_box.sum()
-    # average is weighted by the length of each text box
-  df['pdf_font_size_avg'] = weighted_avg
-  df['pdf_font_size_std'] = df['font_size'].std()
+  df['pdf_font_size_avg'] = compute_weighted_font_size_avg(df, 'pdf_file')
+  df['pdf_font_size_std'] = df.groupby('pdf_file')['font_size'].transform('std')
   return df
   
-def compute_page_font_size_avg(page_df): #weighted average, by number of characters
-  chars_per_text_box = page_df['text'].apply(len)
-  page_df['page_font_size_avg'] = sum(page_df['font_size'] * chars_per_text_box ) // chars_per_text_box.sum()
-  return page_df
-
-def classify_heading_type_in_text_block(row):
-  font_size_Z_score_of_pdf_avg = round((row['font_size'] - row['pdf_font_size_avg']) / row['pdf_font_size_std'], 2) 
-  #font size of this text block, relative to the average for this PDF
-  if (row['font_size'] > config_struct['title_font_size_cutoff']):
-    return 0 #title
-  elif (row['font_size'] > row['page_font_size_avg']) & (font_size_Z_score_of_pdf_avg >= config_struct['subheading_zscore_relative']):
-    return 1 #sub-heading
-  else:
-    return 2 #article text
+def compute_page_font_size_avg(df):
+  df['page_font_size_avg'] = compute_weighted_font_size_avg(df, ['pdf_file', 'page_number'])
+  return df
+
+# Document-wide statistics accumulated one batch of pages at a time, for pipelines which stream pages
+# The variance is combined across batches using Chan et al.'s parallel algorithm
+def update_pdf_font_stats(pdf_font_stats, df):
+  for pdf_file, pdf_df in df.groupby('pdf_file'):
+    chars_per_text_box = pdf_df['text'].apply(len)
+    stats = pdf_font_stats.setdefault(pdf_file, {'weighted_sum': 0, 'chars': 0, 'count': 0, 'mean': 0.0, 'm2': 0.0})
+    stats['weighted_sum'] += int((pdf_df['font_size'] * chars_per_text_box).sum())
+    stats['chars'] += int(chars_per_text_box.sum())
+
+    batch_count, batch_mean = len(pdf_df), pdf_df['font_size'].mean()
+    batch_m2 = ((pdf_df['font_size'] - batch_mean) ** 2).sum()
+    count = stats['count'] + batch_count
+    delta = batch_mean - stats['mean']
+    stats['mean'] += delta * batch_count / count
+    stats['m2'] += batch_m2 + delta ** 2 * stats['count'] * batch_count / count
+    stats['count'] = count
+  return pdf_font_stats
 
-def classify_heading_type(df):
-  df['font_size'] = df.apply(compute_font_size, axis=1)
-  df = df.groupby(['pdf_file', 'page_number'], group_keys=False).apply(compute_page_font_size_avg) 
-  df = df.groupby(['pdf_file'], group_keys=False).apply(compute_pdf_font_stats)
-  df['heading_type'] = df.apply(classify_heading_type_in_text_block, axis=1)
+def apply_pdf_font_stats(df, pdf_font_stats):
+  pdf_font_size_avg = {pdf_file: stats['weighted_sum'] // max(1, stats['chars']) for pdf_file, stats in pdf_font_stats.items()}
+  pdf_font_size_std = {
+    pdf_file: (stats['m2'] / (stats['count'] - 1)) ** 0.5 if stats['count'] > 1 else float('nan')
+    for pdf_file, stats in pdf_font_stats.items()
+  }
+  df['pdf_font_size_avg'] = df['pdf_file'].map(pdf_font_size_avg)
+  df['pdf_font_size_std'] = df['pdf_file'].map(pdf_font_size_std)
+  return df
+
+def classify_heading_types(df):
+  font_size_Z_score_of_pdf_avg = ((df['font_size'] - df['pdf_font_size_avg']) / df['pdf_font_size_std']).round(2)
+  #font size of each text block, relative to the average for its PDF
+  return np.select([
+    df['font_size'] > config_struct['title_font_size_cutoff'],
+    (df['font_size'] > df['page_font_size_avg']) & (font_size_Z_score_of_pdf_avg >= config_struct['subheading_zscore_relative'])
+  ], [
+    0, #title
+    1  #sub-heading
+  ], default=2) #article text
+
+def compute_page_font_stats(df):
+  df['font_size'] = compute_font_size(df)
+  df = compute_page_font_size_avg(df)
+  return df
+
+# pdf_font_stats (from update_pdf_font_stats) is given when pages are streamed, and compute_page_font_stats has already run
+def classify_heading_type(df, pdf_font_stats=None):
+  if pdf_font_stats is None:
+    df = compute_page_font_stats(df)
+    df = compute_pdf_font_stats(df)
+  else:
+    df = apply_pdf_font_stats(df, pdf_font_stats)
+  df['heading_type'] = classify_heading_types(df)
   df.drop(['pdf_font_size_std', 'pdf_font_size_avg', 'page_font_size_avg'], axis=1, inplace=True)
   return df
@@ -0,0 +1,123 @@
+"""
+Lightweight per-stage instrumentation of the pipeline, to show where the time of a slow run went.
+Each stage records its wall time, CPU time, resident memory and item counts (pages, blocks, chars) as one JSON line,
+and the lines of a run are summarised per stage at the end of it.
+Process-pool workers append to the same run file, which is passed to them through the environment.
+A single stage can be run under cProfile, with its stats dumped next to the run file.
+"""
+
+import cProfile
+import json
+import logging
+import os
+import resource
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+
+import pandas
+
+from utils import load_config
+
+config = load_config()
+
+RUN_PATH_ENV = 'PDF_EXTRACTION_INSTRUMENTATION_RUN'
+profiler = None
+
+def is_enabled():
+  return config['instrumentation']['enabled']
+
+def get_run_path():
+  return os.environ.get(RUN_PATH_ENV)
+
+# Called once by the main process, before any worker pools are started
+def start_run():
+  if not is_enabled():
+    return None
+  run_dir = Path(config['instrumentation']['dir'])
+  run_dir.mkdir(parents=True, exist_ok=True)
+  run_path = run_dir / f"run-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.jsonl"
+  os.environ[RUN_PATH_ENV] = str(run_path)
+  logging.info(f'Instrumentation records written to {run_path}')
+  return run_path
+
+def peak_rss_mb():
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def df_counts(df):
+  if df.empty:
+    return {'pages': 0, 'blocks': 0, 'chars': 0}
+  return {'pages': len(df[['pdf_file', 'page_number']].drop_duplicates()), 'blocks': len(df), 'chars': int(df['text'].str.len().sum())}
+
+def text_blocks_counts(text_blocks):
+  return {'blocks': len(text_blocks), 'chars': sum(len(text_block['text']) for text_block in text_blocks)}
+
+def emit(record):
+  with open(get_run_path(), 'a', encoding='utf-8') as f: # a single short append per record, so lines from workers do not interleave
+    f.write(json.dumps(record) + '\n')
+
+# Profiles accumulate across every call of the stage in this process, and are re-dumped after each call
+def profile_path(name):
+  run_path = Path(get_run_path())
+  return run_path.with_name(f'{run_path.stem}-{name}-{os.getpid()}.prof')
+
+# Yields the stage's record, so that counts known only once the stage has run can be added to it
+# Peak RSS is the high-water mark of the process so far; rss_growth_mb is how much the stage raised it
+@contextmanager
+def stage(name, **fields):
+  global profiler
+  record = {'stage': name, **fields}
+  if not is_enabled() or get_run_path() is None:
+    yield record
+    return
+  profiling = name == config['instrumentation']['profile_stage']
+  if profiling:
+    profiler = profiler or cProfile.Profile()
+    profiler.enable()
+  start_rss = peak_rss_mb()
+  start_wall, start_cpu = time.perf_counter(), time.process_time()
+  try:
+    yield record
+  finally:
+    record['wall_s'] = round(time.perf_counter() - start_wall, 4)
+    record['cpu_s'] = round(time.process_time() - start_cpu, 4)
+    if profiling:
+      profiler.disable()
+      profiler.dump_stats(profile_path(name))
+    record['peak_rss_mb'] = round(peak_rss_mb(), 1)
+    record['rss_growth_mb'] = round(peak_rss_mb() - start_rss, 1)
+    record['pid'] = os.getpid()
+    emit(record)
+
+# Runs function(*args) as a stage, counting the pages, blocks and chars of the DataFrame it returns
+def run_stage(name, function, *args, **fields):
+  with stage(name, **fields) as record:
+    df = function(*args)
+    if isinstance(df, pandas.DataFrame) and 'text' in df.columns:
+      record.update(df_counts(df))
+  return df
+
+# Totals per stage across every process of the run, logged and written alongside the run file
+def log_summary():
+  run_path = get_run_path()
+  if not is_enabled() or run_path is None or not Path(run_path).exists():
+    return None
+  summary = defaultdict(lambda: defaultdict(float))
+  with open(run_path, encoding='utf-8') as f:
+    for line in f:
+      record = json.loads(line)
+      stage_summary = summary[record['stage']]
+      stage_summary['calls'] += 1
+      for key in ['wall_s', 'cpu_s', 'pages', 'blocks', 'chars']:
+        stage_summary[key] += record.get(key, 0)
+      stage_summary['peak_rss_mb'] = max(stage_summary['peak_rss_mb'], record['peak_rss_mb'])
+  summary = {name: dict(stage_summary) for name, stage_summary in summary.items()}
+  with open(Path(run_path).with_suffix('.summary.json'), 'w', encoding='utf-8') as f:
+    json.dump(summary, f, indent=2)
+
+  for name, stage_summary in sorted(summary.items(), key=lambda item: -item[1]['wall_s']):
+    logging.info(f"{name}: {stage_summary['calls']:.0f} calls, {stage_summary['wall_s']:.1f}s wall, {stage_summary['cpu_s']:.1f}s CPU, "
+      f"peak RSS {stage_summary['peak_rss_mb']:.0f} MB, {stage_summary['pages']:.0f} pages, {stage_summary['blocks']:.0f} blocks, "
+      f"{stage_summary['chars']:.0f} chars")
+  return summary
@@ -1,34 +1,150 @@
 from pathlib import Path
 import logging
+import tempfile
 
-from ocr import pdf_to_ocr_scanned_df
-from preprocessing import preprocessing
-from detect_structure_elements import classify_heading_type, remove_headers_footers
+import pandas
+
+from ocr import iter_ocr_page_batches
+from preprocessing import preprocessing, shutdown_correction_pool
+from detect_structure_elements import classify_heading_type, remove_headers_footers, compute_page_font_stats, update_pdf_font_stats
 from detect_page_layout import detect_page_layout
-from ner import detect_authors
-from output_format import df_to_formatted_docx
+from ner import assign_authors, collect_page_headings, detect_authors, detect_page_authors
+from output_format import df_to_formatted_docx, FormattedDocxWriter
 from utils import load_config
+import instrumentation
+from instrumentation import run_stage
+import ocr_cache
+from checkpoints import PipelineCheckpoints
+import checkpoints
+
+config = load_config()
+
+def detect_structure(df, pdf_filename):
+  df = run_stage('remove_headers_footers', remove_headers_footers, df, pdf_file=pdf_filename)
+  return run_stage('classify_heading_type', classify_heading_type, df, pdf_file=pdf_filename)
+
+# Each stage's output is checkpointed, so a stage is skipped when neither its input nor its config has changed
+# Runs the stages before NER and spills the frame to disk, returning the PDF's page headings and a function that assigns
+# the run's authors and writes the output; a PDF whose NER output is already checkpointed contributes no headings
+def process_pdf_pipeline(pdf_file_path, OUTPUT_DIR, spill_dir):
+  OUTPUT_DIR = OUTPUT_DIR or config['output_dir']
+  pdf_filename = Path(pdf_file_path).stem
+  stage_checkpoints = PipelineCheckpoints(pdf_file_path)
+  df = stage_checkpoints.run('ocr', run_stage, 'ocr', stage_checkpoints.ocr, pdf_file=pdf_filename)
+  df = stage_checkpoints.run('preprocessing', run_stage, 'preprocessing', preprocessing, df, pdf_file=pdf_filename)
+  df = stage_checkpoints.run('structure', detect_structure, df, pdf_filename)
+  df = stage_checkpoints.run('layout', run_stage, 'detect_page_layout', detect_page_layout, df, pdf_file=pdf_filename)
+  page_headings = []
+  if stage_checkpoints.is_saved('ner'): # NER runs on this PDF alone only if its checkpoint turns out to be unreadable
+    df = stage_checkpoints.run('ner', run_stage, 'detect_authors', detect_authors, df, pdf_file=pdf_filename)
+  else:
+    page_headings.append(collect_page_headings(df))
+  spill_dir.mkdir(parents=True)
+  spill_path = spill_dir / 'layout.pkl'
+  df.to_pickle(spill_path)
+
+  def write_output(authors):
+    df = pandas.read_pickle(spill_path)
+    if 'author' not in df.columns:
+      df = stage_checkpoints.run('ner', run_stage, 'assign_authors', assign_authors, df, authors, pdf_file=pdf_filename)
+    with instrumentation.stage('output_format', pdf_file=pdf_filename, **instrumentation.df_counts(df)):
+      df.sort_values(by=['pdf_file', 'page_number', 'heading_type', 'column_position', 'centre_y'], inplace=True)
+      df.groupby('pdf_file').apply(df_to_formatted_docx, str(OUTPUT_DIR))
+    spill_path.unlink()
+  return page_headings, write_output
 
-def process_pdf_pipeline(pdf_file_path):
-  df = pdf_to_ocr_scanned_df(pdf_file_path)
-  df = preprocessing(df)
-  df = remove_headers_footers(df)
-  df = classify_heading_type(df)
-  df = detect_page_layout(df)
-  df = detect_authors(df)
-  df.sort_values(by=['pdf_file', 'page_number', 'heading_type', 'column_position', 'centre_y'], inplace=True)
-  df.groupby('pdf_file').apply(df_to_formatted_docx)
+# Pages flow through the page-local stages in batches, so memory stays flat regardless of the length of the PDF
+# Heading classification needs the PDF's font statistics, so the first pass accumulates them and spills each batch to disk;
+# the second pass classifies, lays out and collects the headings of each batch, and write_output assigns authors and writes them
+# OCR is recorded by its per-page sub-steps, as it runs while the batches are being iterated
+def process_pdf_pipeline_streaming(pdf_file_path, OUTPUT_DIR, spill_dir):
+  pdf_filename = Path(pdf_file_path).stem
+  pdf_font_stats = {}
+  spill_dir.mkdir(parents=True)
+  spill_paths = []
+  for batch_number, df in enumerate(iter_ocr_page_batches(pdf_file_path, config['streaming']['batch_pages'])):
+    df = run_stage('preprocessing', preprocessing, df, pdf_file=pdf_filename, batch=batch_number)
+    df = run_stage('remove_headers_footers', remove_headers_footers, df, pdf_file=pdf_filename, batch=batch_number)
+    if df.empty:
+      continue
+    df = compute_page_font_stats(df)
+    update_pdf_font_stats(pdf_font_stats, df)
+    spill_paths.append(spill_dir / f'{batch_number}.pkl')
+    df.to_pickle(spill_paths[-1])
+
+  page_headings = []
+  for batch_number, spill_path in enumerate(spill_paths):
+    df = pandas.read_pickle(spill_path)
+    df = run_stage('classify_heading_type', classify_heading_type, df, pdf_font_stats, pdf_file=pdf_filename, batch=batch_number)
+    df = run_stage('detect_page_layout', detect_page_layout, df, pdf_file=pdf_filename, batch=batch_number)
+    page_headings.append(collect_page_headings(df))
+    df.to_pickle(spill_path)
+
+  def write_output(authors):
+    writer = FormattedDocxWriter(pdf_filename, str(OUTPUT_DIR))
+    for batch_number, spill_path in enumerate(spill_paths):
+      df = pandas.read_pickle(spill_path)
+      df = run_stage('assign_authors', assign_authors, df, authors, pdf_file=pdf_filename, batch=batch_number)
+      with instrumentation.stage('output_format', pdf_file=pdf_filename, batch=batch_number, **instrumentation.df_counts(df)):
+        df.sort_values(by=['pdf_file', 'page_number', 'heading_type', 'column_position', 'centre_y'], inplace=True)
+        writer.write(df)
+      spill_path.unlink()
+    writer.close()
+  return page_headings, write_output
+
+# Every PDF in the run is taken up to NER first, so that NER runs once over the headings of all of them,
+# rather than over a few part-filled batches per PDF; each PDF's frame waits on disk meanwhile, so memory does not grow with the run
+# A PDF's output therefore only appears once every PDF in the run has been OCR'd
+# A PDF which fails at any stage is logged and skipped, so that it does not lose the outputs of the others; failures are returned
+def process_pdfs(pdf_file_paths, OUTPUT_DIR, streaming=None):
+  streaming = config['streaming']['enabled'] if streaming is None else streaming
+  process_pdf_stages = process_pdf_pipeline_streaming if streaming else process_pdf_pipeline
+  failures = {}
+  with tempfile.TemporaryDirectory() as spill_dir:
+    pdfs = []
+    for i, pdf_file_path in enumerate(pdf_file_paths):
+      try:
+        pdfs.append((pdf_file_path, *process_pdf_stages(pdf_file_path, OUTPUT_DIR, Path(spill_dir) / str(i))))
+      except Exception as e:
+        logging.exception(f'{pdf_file_path} failed and is skipped: {e}')
+        failures[pdf_file_path] = e
+    page_headings = [batch_page_headings for _, pdf_page_headings, _ in pdfs for batch_page_headings in pdf_page_headings]
+    authors = run_stage('detect_authors', detect_page_authors, page_headings, pages=sum(len(headings) for headings in page_headings))
+    for pdf_file_path, _, write_output in pdfs:
+      try:
+        write_output(authors)
+      except Exception as e:
+        logging.exception(f'{pdf_file_path} failed while writing its output: {e}')
+        failures[pdf_file_path] = e
+  return failures
+
+# Raises the PDF's failure, e.g. for the service to record against its job
+def process_pdf(pdf_file_path, OUTPUT_DIR):
+  failures = process_pdfs([pdf_file_path], OUTPUT_DIR)
+  if failures:
+    raise failures[pdf_file_path]
 
 def main():
   logging.basicConfig(level=logging.INFO)
-  config = load_config()
   INPUT_DIR, OUTPUT_DIR = Path(config['input_dir']), Path(config['output_dir'])
   OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
   pdf_file_paths = sorted(list(INPUT_DIR.glob('*.pdf')))
 
+  if config['ocr_cache']['invalidate']:
+    ocr_cache.clear()
+  if config['checkpoints']['invalidate']:
+    checkpoints.clear()
+  instrumentation.start_run()
+
   logging.info(f"Scanning {len(pdf_file_paths)} PDF files: {pdf_file_paths}")
-  for pdf_file_path in pdf_file_paths:
-    process_pdf_pipeline(pdf_file_path)
+  try:
+    failures = process_pdfs(pdf_file_paths, OUTPUT_DIR)
+  finally:
+    shutdown_correction_pool()
+  if failures:
+    logging.error(f'{len(failures)} of {len(pdf_file_paths)} PDF files failed: {list(failures)}')
+  ocr_cache.log_stats()
+  instrumentation.log_summary()
 
 if __name__ == "__main__":
   main()
\ No newline at end of file
@@ -2,44 +2,92 @@
 Detects Author names within article text for structured, meaningful outputs
 Uses a BERT-based Named-Entity-Recognition (NER) language model
 Can additionally match detected names against a given list using fuzzy matching and trie-based search.
+Fuzzy matching only scores the names which share character trigrams with the detected name, using an index built once.
 """
 import re
-from torch import cuda
-from transformers import AutoTokenizer, AutoModelForTokenClassification, pipeline
+import time
+import logging
+from collections import Counter, defaultdict
+from functools import lru_cache
 from pytrie import SortedStringTrie as Trie
 from Levenshtein import ratio
 
 from utils import load_pkl_file, load_model, load_config
+import registry
 
 AUTHOR_NAMES_FILEPATH = 'data/author_names.pkl'
 alphabetic_chars = re.compile(r'[a-zA-Z]')
-ner_classifier = None
-author_names_list = None
-author_names_trie = None
-config = None
+config = load_config()
 
+# 'int8' applies dynamic quantisation to the model's linear layers, for faster inference on CPU-only machines
+# Quantised models run on CPU only
+# torch and transformers are only imported here, when the registry first loads the classifier
+def load_ner_classifier(backend):
+  import torch
+  from transformers import AutoTokenizer, AutoModelForTokenClassification, pipeline
+  tokenizer = load_model(AutoTokenizer.from_pretrained(config['ner']['model_name']), 'BERT Tokenizer')
+  model = load_model(AutoModelForTokenClassification.from_pretrained(config['ner']['model_name']), 'BERT base model')
+  if backend == 'int8':
+    model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+  else:
+    model = model.to("cuda:0" if torch.cuda.is_available() else "cpu")
+  return pipeline("ner", model=model, tokenizer=tokenizer, aggregation_strategy='average')
 
+# The trie and the trigram index of the known author names
+def load_author_names():
+  author_names_df = load_pkl_file(config['author_names_filepath'])
+  author_names_trie = Trie({remove_spaces(name):name for _,name in author_names_df['fullname'].iteritems()})
+  author_names_index = AuthorNamesIndex(sorted(author_names_df['fullname'].to_list()))
+  match_author_name.cache_clear()
+  return author_names_trie, author_names_index
 
+registry.register('ner_classifier', lambda: load_ner_classifier(config['ner']['backend']))
+registry.register('author_names', load_author_names)
 
+def init_models():
+  registry.warm_up(['ner_classifier', 'author_names'])
 
-def __init__(self):
-  self.config = load_config()
-  tokenizer = load_model(AutoTokenizer.from_pretrained(config['ner']['dslim/bert-base-NER']), 'BERT Tokenizer')
-  device = "cuda:0" if cuda.is_available() else "cpu"
-  model = load_model(AutoModelForTokenClassification.from_pretrained(config['ner']['dslim/bert-base-NER']).to(device), 'BERT base model')
-  self.ner_classifier = pipeline("ner", model=model, tokenizer=tokenizer, aggregation_strategy='average')
+# Inverted index from character trigrams to the names containing them
+# Candidates for a name are those sharing the most trigrams with it, which are then scored exactly using Levenshtein ratio
+class AuthorNamesIndex:
+  def __init__(self, names):
+    self.names = names
+    self.postings = defaultdict(list)
+    for i, name in enumerate(names):
+      for trigram in self.trigrams(name):
+        self.postings[trigram].append(i)
 
-  author_names_df = load_pkl_file(config['author_names_filepath'])
-  self.author_names_trie = Trie({remove_spaces(name):name for _,name in author_names_df['fullname'].iteritems()})
-  self.author_names_list = sorted(author_names_df['fullname'].to_list())
+  @staticmethod
+  def trigrams(name):
+    padded = f' {name.lower()} '
+    return {padded[i:i+3] for i in range(len(padded) - 2)}
+
+  def candidates(self, name):
+    shared_trigrams = Counter(i for trigram in self.trigrams(name) for i in self.postings.get(trigram, ()))
+    return [i for i, _ in shared_trigrams.most_common(config['ner']['match_candidates'])]
+
+  # The best-scoring name above the cutoff (the first alphabetically, if tied), or None
+  def best_match(self, name, score_cutoff):
+    best_score, best_i = 0, None
+    for i in self.candidates(name):
+      score = ratio(self.names[i], name, score_cutoff=score_cutoff)
+      if score > best_score or (score and score == best_score and i < best_i):
+        best_score, best_i = score, i
+    return None if best_i is None else self.names[best_i]
 
 def remove_spaces(string):
   return re.sub(' ','', string).lower()
 
 def spell_check_author_name(author):
-  for author_true in author_names_list:
-    if ratio(author_true, author, score_cutoff=config['ner']['score_cutoff']):
-      return author_true
+  return match_author_name(' '.join(author.split()))
+
+# Memoised, as the same bylines recur across every issue
+@lru_cache(maxsize=config['ner']['match_cache_size'])
+def match_author_name(author):
+  author_names_trie, author_names_index = registry.get('author_names')
+  author_true = author_names_index.best_match(author, config['ner']['score_cutoff'])
+  if author_true is not None:
+    return author_true
   author_name = author_names_trie.longest_prefix_value(remove_spaces(author), default=author)
   return author_name
 
@@ -49,20 +97,46 @@ def df_to_string(text_df, separator='\n\n'):
 def safe_get_first_elem(lst, if_none=''):
   return next(iter(lst[0:]), if_none)
 
-def detect_author_in_page(page_df): #Assume one article maximum per page (or none)
-  if page_df[page_df['title_subheading_article']==0].empty: #if no title on page, skip
-    page_df['author'] = ''
-    return page_df
-  text = df_to_string(page_df[page_df['title_subheading_article']<2].sort_values(by='title_subheading_article'), separator='. ')
-  if not re.search(alphabetic_chars, text): # NER fails on input without any alphabetic characters
-    page_df['author'] = ''
-    return page_df
-  names = [tag['word'] for tag in ner_classifier(text.title()) if tag['entity_group']=='PER'] 
-    # More effective performance when only the first letter is capitalised, hence title()
-  first_name_in_text = safe_get_first_elem(names)
-  page_df['author'] = spell_check_author_name(first_name_in_text)
-  return page_df
+# First pass: the titles and subheadings of each page with a title, joined into one string per page
+# Assumes one article maximum per page (or none)
+def collect_page_headings(df):
+  headings = df[df['heading_type']<2].sort_values(by='heading_type', kind='stable')
+  headings = headings[headings.groupby(['pdf_file', 'page_number'])['heading_type'].transform('min')==0] #if no title on page, skip
+  page_headings = headings.groupby(['pdf_file', 'page_number'])['text'].agg('. '.join)
+  return page_headings[page_headings.str.contains(alphabetic_chars)] # NER fails on input without any alphabetic characters
+
+# Second pass: runs NER over every page's headings in batches of similar length, so little of each batch is padding
+def detect_person_names(texts):
+  if not texts: # e.g. every PDF in the run resumed from its NER checkpoint, so the model need not be loaded
+    return []
+  batch_size = config['ner']['batch_size']
+  ner_classifier = registry.get('ner_classifier')
+  names = [None] * len(texts)
+  order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+  for start in range(0, len(order), batch_size):
+    batch_order = order[start:start+batch_size]
+    tags_per_text = ner_classifier([texts[i].title() for i in batch_order], batch_size=len(batch_order))
+      # More effective performance when only the first letter is capitalised, hence title()
+    for i, tags in zip(batch_order, tags_per_text):
+      names[i] = [tag['word'] for tag in tags if tag['entity_group']=='PER']
+  return names
+
+# Runs NER once over the page headings of every PDF in the run, so that batches are filled across PDFs rather than within each
+# Returns the author of each (pdf_file, page_number) with headings
+def detect_page_authors(page_headings_per_frame):
+  start = time.perf_counter()
+  pages = [page for page_headings in page_headings_per_frame for page in page_headings.index]
+  texts = [text for page_headings in page_headings_per_frame for text in page_headings.tolist()]
+  names_per_page = detect_person_names(texts)
+  authors = {page: spell_check_author_name(safe_get_first_elem(names)) for page, names in zip(pages, names_per_page)}
+
+  elapsed = time.perf_counter() - start
+  logging.info(f'Author detection: {len(pages)} pages in {elapsed:.1f}s ({len(pages) / max(elapsed, 1e-9):.1f} pages/sec)')
+  return authors
+
+def assign_authors(df, authors):
+  df['author'] = [authors.get(page, '') for page in zip(df['pdf_file'], df['page_number'])]
+  return df
 
 def detect_authors(df):
-  df = df.groupby(['pdf_file', 'page_number']).apply(detect_author_in_page) #detect author
-  return df
\ No newline at end of file
+  return assign_authors(df, detect_page_authors([collect_page_headings(df)]))
@@ -3,6 +3,7 @@ Converts PDFs of scanned images to a structured Pandas Dataframe of text
 Images are acquired with PyMuPDF and filtered via unsharp masking, and adaptive thresholding.
 Text and their boundaries are detected using Detectron2 and the text strings are extracted using TesseractOCR
 Metadata is retained for further processing and layout detection (e.g. bounding box XY coordinates)
+In multi-resolution mode, layouts are detected on a low-dpi render and only the text regions are rendered at full resolution
 """
 
 from io import BytesIO
@@ -11,41 +12,78 @@ from PIL import Image
 import fitz
 import numpy as np
 import pandas
-from layoutparser import Detectron2LayoutModel, TesseractAgent, Layout
 import cv2
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
 import logging
+import re
 
 from utils import load_model, load_fitz_file, load_config
+import instrumentation
+import ocr_cache
+import registry
 
-layout_detecting_model = None
-ocr_agent = None
-mat = None
-config = None
+mat = fitz.Matrix(300 / 72, 300 / 72)  # sets Zoom Factor to 300 dpi
+config = load_config()
 
-def __init__(self):
-  self.config = load_config()
+# Set in each process-pool worker by init_ocr_worker, so pages are never pickled between processes
+worker_pdf_file = None
+worker_pdf_file_path = None
 
-  self.layout_detecting_model = load_model(Detectron2LayoutModel(
-    config_path=self.config['detectron2']['path'],
+# Models are loaded through the registry on first use; layoutparser (and with it torch and Detectron2) is only imported then
+def load_layout_detecting_model():
+  from layoutparser import Detectron2LayoutModel
+  return load_model(Detectron2LayoutModel(
+    config_path=config['detectron2']['path'],
     extra_config=["MODEL.ROI_HEADS.SCORE_THRESH_TEST", 0.5],
-    label_map=self.config['detectron2']['label_map']
+    label_map=config['detectron2']['label_map']
   ), model_name='Detectron2 Layout Model')
-  self.ocr_agent = load_model(TesseractAgent(
+
+def load_ocr_agent():
+  from layoutparser import TesseractAgent
+  return load_model(TesseractAgent(
     languages='eng', 
-    config=self.config['ocr']['tesseract_config']  # speed up OCR by not checking for inverted text
+    config=config['ocr']['tesseract_config']  # speed up OCR by not checking for inverted text
   ), model_name='Tesseract Agent OCR model')
-  self.mat = fitz.Matrix(300 / 72, 300 / 72)  # sets Zoom Factor to 300 dpi
+
+# A persistent Tesseract handle, so the LSTM model is initialised once per process rather than once per text block
+# The handle is not thread-safe, so pages are OCR'd in worker processes rather than threads
+def load_tesseract_api():
+  from tesserocr import PyTessBaseAPI
+  api = PyTessBaseAPI(path=config['tesseract_data_dir'], lang='eng')
+  for name, value in re.findall(r'-c\s+(\S+)=(\S+)', config['ocr']['tesseract_config']):
+    api.SetVariable(name, value)  # same '-c' variables as the Tesseract Agent
+  return api
+
+registry.register('layout_detecting_model', load_layout_detecting_model)
+registry.register('ocr_agent', load_ocr_agent)
+registry.register('tesseract_api', load_tesseract_api)
+
+# Loads every model OCR will use, e.g. before a worker takes any pages
+def init_models():
+  registry.warm_up(['layout_detecting_model', 'ocr_agent'] + (['tesseract_api'] if config['ocr']['engine'] == 'tesserocr' else []))
 
 def page_to_img(page_obj):
   pix = page_obj.get_pixmap(matrix=mat) 
   img = pix.tobytes(output='png')
-  return np.array(Image.open(BytesIO(img)))
+  return pix, np.array(Image.open(BytesIO(img)))
+
+# Renders straight to a grayscale pixmap at the final resolution (300 dpi * scale factor), skipping PNG encoding
+# The image is a view onto the pixmap's samples rather than a copy, so the pixmap must be kept alive while it is used
+# clip is a rectangle in PDF points, to render only part of the page
+def page_to_gray_img(page_obj, dpi=None, clip=None):
+  zoom = (dpi or 300 * config['ocr']['scale_factor']) / 72
+  pix = page_obj.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY, alpha=False, clip=clip)
+  img = np.frombuffer(pix.samples_mv, dtype=np.uint8).reshape(pix.height, pix.stride)[:, :pix.width]
+  return pix, img
 
 #Enlarges and converts to black-and-white for more effective OCR
 def pre_process_img(img):
+  if config['ocr']['render_mode'] == 'gray': # already rendered at the final size in grayscale
+    return img
   img = cv2.resize(img, (0,0), fx=config['ocr']['scale_factor'], fy=config['ocr']['scale_factor']) 
   img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+  return img
 
 
 #Note: larger Sigma value allows greater variance around the mean, leading to more noise
@@ -55,7 +93,9 @@ def unsharp_mask(img):
   # The blur is subtracted from the original image using the '2.0' and '-1.0' weightings
   return img
 
-def thresholding(img):
+def macro_details_mask(img):
+  if config['ocr']['enhancement'] == 'fast':
+    return macro_details_mask_downsampled(img)
   img_macro_details = cv2.adaptiveThreshold(
     img, 
     255, 
@@ -65,8 +105,32 @@ def thresholding(img):
     C=config['ocr']['adaptive_threshold']['macro_C'])
   kernel = np.ones((5,5), np.uint8) 
   img_macro_details = cv2.dilate(img_macro_details, kernel, iterations=5)
+  return img_macro_details
+
+# The macro mask only marks large areas, so it is computed at 1/macro_downsample scale and upsampled
+# Five dilations by a 5x5 square equal a single dilation by a 21x21 square, which OpenCV applies as separable row and column passes
+# The threshold block size and the dilation are scaled down with the image; with macro_downsample: 1 the mask is identical
+def macro_details_mask_downsampled(img):
+  factor = config['ocr']['macro_downsample']
+  small_img = cv2.resize(img, (0,0), fx=1/factor, fy=1/factor, interpolation=cv2.INTER_AREA) if factor > 1 else img
+  img_macro_details = cv2.adaptiveThreshold(
+    small_img,
+    255,
+    cv2.ADAPTIVE_THRESH_MEAN_C,
+    cv2.THRESH_BINARY,
+    blockSize=max(3, config['ocr']['adaptive_threshold']['macro_block_size'] // factor | 1),
+    C=config['ocr']['adaptive_threshold']['macro_C'])
+  kernel_size = max(1, round(21 / factor))
+  img_macro_details = cv2.dilate(img_macro_details, cv2.getStructuringElement(cv2.MORPH_RECT, (kernel_size, kernel_size)))
+  if factor > 1:
+    img_macro_details = cv2.resize(img_macro_details, (img.shape[1], img.shape[0]), interpolation=cv2.INTER_NEAREST)
+  return img_macro_details
 
-  get_block_size = lambda img: int(np.shape(img)[0]/300)*10 | 1
+# page_height is given when img is a region of a page, so the block size still follows the size of the whole page
+def thresholding(img, page_height=None):
+  img_macro_details = macro_details_mask(img)
+
+  get_block_size = lambda img: int((page_height or np.shape(img)[0])/300)*10 | 1
   # Thresholding's performance is dependent on the block size, which is sensitive to image size
   # e.g. size=11 works well for 3300-pixel-wide image
   # Block size must be an odd number, this is ensured using the final "| 1" binary operation
@@ -80,22 +144,64 @@ def thresholding(img):
     C=config['ocr']['adaptive_threshold']['micro_C']) 
   # C determines how much darker a pixel should be (compared to the average neighbouring pixel) to be retained as a detail
     
-  img = cv2.bitwise_and(img_micro_details, img_macro_details)  #combine images
+  img = cv2.bitwise_and(img_micro_details, img_macro_details, dst=img_micro_details)  #combine images, in place
   return img
 
+# Detectron2 expects 3-channel images, whereas thresholding produces a single grayscale channel
+def to_layout_model_input(img):
+  return cv2.cvtColor(img, cv2.COLOR_GRAY2RGB) if img.ndim == 2 else img
+
+# Runs several page images through Detectron2 in a single forward pass, returning one Layout per page
+# Mirrors the preprocessing done by Detectron2's DefaultPredictor, which only accepts one image at a time
+def detect_layouts(imgs):
+  layout_detecting_model = registry.get('layout_detecting_model')
+  if len(imgs) == 1:
+    return [layout_detecting_model.detect(to_layout_model_input(imgs[0]))]
+  import torch
+  predictor = layout_detecting_model.model
+  inputs = []
+  for img in imgs:
+    img = to_layout_model_input(img)
+    if predictor.input_format == 'RGB':
+      img = img[:, :, ::-1]
+    height, width = img.shape[:2]
+    img = predictor.aug.get_transform(img).apply_image(img)
+    inputs.append({'image': torch.as_tensor(img.astype('float32').transpose(2, 0, 1)), 'height': height, 'width': width})
+  with torch.no_grad():
+    outputs = predictor.model(inputs)
+  return [layout_detecting_model.gather_output(output) for output in outputs]
 
+# Uploads the page image to Tesseract once, then OCRs each text block as a region-of-interest rectangle
+# Uses the same padded, integer coordinates as cropping the image in bounding_boxes_to_text
+def regions_to_text(boxes, img):
+  PAD_SIZE = config['ocr']['pad_size']
+  tesseract_api = registry.get('tesseract_api')
+  height, width = img.shape[:2]
+  img = np.ascontiguousarray(img)
+  tesseract_api.SetImageBytes(img.tobytes(), width, height, 1, width)
+  for box in boxes:
+    x_1, y_1, x_2, y_2 = (int(c) for c in box.pad(left=PAD_SIZE, right=PAD_SIZE, top=PAD_SIZE, bottom=PAD_SIZE).coordinates)
+    x_1, y_1 = max(0, x_1), max(0, y_1)
+    x_2, y_2 = min(x_2, width), min(y_2, height)
+    tesseract_api.SetRectangle(x_1, y_1, x_2 - x_1, y_2 - y_1)
+    box.set(text=tesseract_api.GetUTF8Text(), inplace=True)
+  tesseract_api.Clear()
+  return boxes
 
-def img_to_text_blocks(img):
+def img_to_text_blocks(img, layout_result=None):
   # Crops the original image to each bounding box of a text-block
   # Adds padding to improve robustness, in case any words are partially cut-off
   PAD_SIZE = config['ocr']['pad_size']
   def bounding_boxes_to_text(box, img):
-    text = ocr_agent.detect(
+    text = registry.get('ocr_agent').detect(
       box.pad(left=PAD_SIZE, right=PAD_SIZE, top=PAD_SIZE, bottom=PAD_SIZE).crop_image(img)
     )
     return box.set(text=text, inplace=True)
-  layout_result = layout_detecting_model.detect(img)
-  bounding_boxes_list = Layout([b for b in layout_result if b.type != "Figure"]) # 'Figure' == image
+  if layout_result is None:
+    layout_result = detect_layouts([img])[0]
+  bounding_boxes_list = [b for b in layout_result if b.type != "Figure"] # 'Figure' == image
+  if config['ocr']['engine'] == 'tesserocr':
+    return list(regions_to_text(bounding_boxes_list, img))
   text_blocks = [bounding_boxes_to_text(box, img) for box in bounding_boxes_list]
   return text_blocks
 
@@ -111,28 +217,206 @@ def format_text_blocks(text_blocks, pdf_filename, page_number):
     'text': text_block.text
   } for text_block in text_blocks]
 
-def pdf_page_to_text_blocks(pdf_page, pdf_filename, page_number):
-  img = page_to_img(pdf_page)
+# Returns the pixmap alongside the image, as its samples key the OCR cache
+def render_page(pdf_page):
+  if config['ocr']['render_mode'] == 'gray':
+    return page_to_gray_img(pdf_page)
+  return page_to_img(pdf_page)
+
+def enhance_img(img):
   img = pre_process_img(img)
   img = unsharp_mask(img)
   img = thresholding(img)
-  text_blocks = img_to_text_blocks(img)
-  text_blocks = format_text_blocks(text_blocks, pdf_filename, page_number)
+  return img
+
+def page_to_enhanced_img(pdf_page):
+  pix, img = render_page(pdf_page)
+  return enhance_img(img)
+
+# Layout detection does not need the full resolution, and Detectron2 resizes its input to around 800 pixels anyway
+def page_to_layout_img(pdf_page):
+  return page_to_gray_img(pdf_page, dpi=config['ocr']['multi_resolution']['layout_dpi'])
+
+def region_img_to_text(img):
+  if config['ocr']['engine'] == 'tesserocr':
+    tesseract_api = registry.get('tesseract_api')
+    height, width = img.shape[:2]
+    tesseract_api.SetImageBytes(np.ascontiguousarray(img).tobytes(), width, height, 1, width)
+    return tesseract_api.GetUTF8Text()
+  return registry.get('ocr_agent').detect(img)
+
+# Boxes detected on the low-dpi render are scaled to the pixels of the full-resolution page, as in single-resolution mode,
+# then only their padded regions are rendered, enhanced and OCR'd; Figures and margins are never rendered at full resolution
+def layout_to_text_blocks_multi_resolution(pdf_page, layout_result):
+  PAD_SIZE = config['ocr']['pad_size']
+  dpi = 300 * config['ocr']['scale_factor']
+  scale = dpi / config['ocr']['multi_resolution']['layout_dpi']
+  page_height = int(pdf_page.rect.height * dpi / 72)
+  text_blocks = []
+  for box in layout_result:
+    if box.type == "Figure": # 'Figure' == image
+      continue
+    box = box.scale(scale)
+    clip = fitz.Rect(box.pad(left=PAD_SIZE, right=PAD_SIZE, top=PAD_SIZE, bottom=PAD_SIZE).coordinates) * (72 / dpi) & pdf_page.rect
+    if clip.is_empty:
+      continue
+    pix, img = page_to_gray_img(pdf_page, clip=clip)
+    img = thresholding(unsharp_mask(img), page_height)
+    text_blocks.append(box.set(text=region_img_to_text(img)))
   return text_blocks
 
-def pdf_to_ocr_scanned_df(pdf_file_path):
+# Layout detection is batched across pages, Figure filtering and Tesseract OCR remain per page
+# Pages found in the OCR cache skip image enhancement, layout detection and OCR entirely
+# In multi-resolution mode, pages are keyed on their low-dpi render
+def pdf_pages_to_text_blocks(pdf_file, pdf_filename, page_numbers):
+  multi_resolution = config['ocr']['multi_resolution']['enabled']
+  pages_text_blocks = {}
+  imgs, cache_keys, uncached_page_numbers = [], [], []
+  for page_number in page_numbers:
+    page_fields = {'pdf_file': pdf_filename, 'page_number': page_number, 'pages': 1}
+    with instrumentation.stage('ocr.render', **page_fields):
+      pix, img = page_to_layout_img(pdf_file[page_number]) if multi_resolution else render_page(pdf_file[page_number])
+    with instrumentation.stage('ocr.cache_lookup', **page_fields):
+      cache_key = ocr_cache.page_key(pix.samples_mv) if ocr_cache.is_enabled() else None
+      cached_text_blocks = ocr_cache.get(cache_key, pdf_filename, page_number) if cache_key else None
+    if cached_text_blocks is not None:
+      pages_text_blocks[page_number] = cached_text_blocks
+      continue
+    # The low-dpi render is enhanced as the full-resolution one is, so that Detectron2 sees the same kind of image in either mode
+    with instrumentation.stage('ocr.enhance', **page_fields):
+      img = thresholding(unsharp_mask(img)) if multi_resolution else enhance_img(img)
+    imgs.append(img)
+    cache_keys.append(cache_key)
+    uncached_page_numbers.append(page_number)
+
+  with instrumentation.stage('ocr.layout_detection', pdf_file=pdf_filename, pages=len(imgs)):
+    layouts = detect_layouts(imgs) if imgs else []
+  for img, layout_result, page_number, cache_key in zip(imgs, layouts, uncached_page_numbers, cache_keys):
+    # In multi-resolution mode this includes rendering and enhancing the text regions
+    with instrumentation.stage('ocr.text_recognition', pdf_file=pdf_filename, page_number=page_number, pages=1) as record:
+      if multi_resolution:
+        text_blocks = layout_to_text_blocks_multi_resolution(pdf_file[page_number], layout_result)
+      else:
+        text_blocks = img_to_text_blocks(img, layout_result)
+      text_blocks = format_text_blocks(text_blocks, pdf_filename, page_number)
+      record.update(instrumentation.text_blocks_counts(text_blocks))
+    if cache_key:
+      ocr_cache.put(cache_key, text_blocks)
+    pages_text_blocks[page_number] = text_blocks
+  return [pages_text_blocks[page_number] for page_number in page_numbers]
+
+def page_batches(page_numbers, batch_size=None):
+  batch_size = batch_size or config['detectron2']['batch_size']
+  return [page_numbers[i:i + batch_size] for i in range(0, len(page_numbers), batch_size)]
+
+# A born-digital page is detected by the number of characters and the fraction of the page covered by glyphs
+# Characters PyMuPDF cannot map to unicode (U+FFFD) are not counted, as their text is unusable
+def has_text_layer(page_dict, page_rect):
+  spans = [span for block in page_dict['blocks'] if block['type'] == 0 for line in block['lines'] for span in line['spans']]
+  char_count = sum(len(span['text'].replace('\ufffd', '').strip()) for span in spans)
+  glyph_area = sum(abs(fitz.Rect(span['bbox'])) for span in spans if span['text'].strip())
+  return char_count >= config['ocr']['text_layer']['min_chars'] \
+    and glyph_area / max(1, abs(page_rect)) >= config['ocr']['text_layer']['min_glyph_coverage']
+
+# Text blocks read from the embedded text layer, with PDF coordinates scaled to the pixels of the OCR'd page images
+def text_layer_to_text_blocks(page_dict, pdf_filename, page_number):
+  zoom = 300 * config['ocr']['scale_factor'] / 72
+  text_blocks = []
+  for block in page_dict['blocks']:
+    if block['type'] != 0: # 1 == image
+      continue
+    text = '\n'.join(''.join(span['text'] for span in line['spans']) for line in block['lines'])
+    if not text.strip():
+      continue
+    x_1, y_1, x_2, y_2 = (coordinate * zoom for coordinate in block['bbox'])
+    text_blocks.append({
+      'left': int(x_1),
+      'top': int(y_1),
+      'bottom': int(y_2),
+      'right': int(x_2),
+      'pdf_file': pdf_filename,
+      'page_number': page_number,
+      'text': text
+    })
+  return text_blocks
+
+# Each worker loads its own models and reopens the PDF once, rather than receiving pickled page objects
+def init_ocr_worker(pdf_file_path, cache_counters):
+  global worker_pdf_file, worker_pdf_file_path
+  ocr_cache.counters = cache_counters
+  init_models()
+  worker_pdf_file = load_fitz_file(pdf_file_path)
+  worker_pdf_file_path = pdf_file_path
+
+def ocr_pages_in_worker(page_numbers):
+  return pdf_pages_to_text_blocks(worker_pdf_file, worker_pdf_file_path, page_numbers)
+
+def pdf_pages_to_text_blocks_serial(pdf_file, pdf_file_path, page_numbers):
+  if page_numbers:
+    init_models()
+  for batch in page_batches(page_numbers):
+    yield from pdf_pages_to_text_blocks(pdf_file, pdf_file_path, batch)
+
+def pdf_pages_to_text_blocks_parallel(pdf_file_path, page_numbers, workers):
+  with ProcessPoolExecutor(max_workers=workers, initializer=init_ocr_worker, initargs=(pdf_file_path, ocr_cache.counters)) as executor:
+    # map() returns results in page order, regardless of which worker finishes first
+    for pages_text_blocks in executor.map(ocr_pages_in_worker, page_batches(page_numbers), chunksize=config['ocr']['parallel']['chunk_size']):
+      yield from pages_text_blocks
+
+# Yields one DataFrame of text blocks per page, in page order
+# page_numbers restricts the pages read, e.g. to those missing from a resumed run's checkpoint
+def pdf_to_page_dfs(pdf_file_path, workers=None, page_numbers=None):
   pdf_filename = Path(pdf_file_path).stem
-  df = pandas.DataFrame()
+  workers = workers or config['ocr']['parallel']['workers']
   pdf_file = load_fitz_file(pdf_file_path)
+  page_numbers = range(pdf_file.page_count) if page_numbers is None else page_numbers
 
-  for page_number,_ in enumerate(pdf_file):
+  # Only scanned pages are routed to OCR. Text-layer pages are re-read when they are reached, to keep memory flat
+  text_layer_page_numbers = set()
+  scanned_page_numbers = []
+  for page_number in page_numbers:
     page = pdf_file[page_number]
-    text_blocks = pdf_page_to_text_blocks(page, pdf_file_path, page_number)
-    df = pandas.concat([df, pandas.DataFrame(text_blocks)])
+    if config['ocr']['text_layer']['enabled'] and has_text_layer(page.get_text('dict'), page.rect):
+      text_layer_page_numbers.add(page_number)
+    else:
+      scanned_page_numbers.append(page_number)
+  logging.info(f'{pdf_filename}: {len(text_layer_page_numbers)} pages read from the embedded text layer, {len(scanned_page_numbers)} pages sent to OCR')
+
+  if workers > 1 and scanned_page_numbers:
+    ocr_pages_text_blocks = pdf_pages_to_text_blocks_parallel(pdf_file_path, scanned_page_numbers, workers)
+  else:
+    ocr_pages_text_blocks = pdf_pages_to_text_blocks_serial(pdf_file, pdf_file_path, scanned_page_numbers)
+
+  for page_number in page_numbers:
+    if page_number in text_layer_page_numbers:
+      with instrumentation.stage('ocr.text_layer', pdf_file=pdf_filename, page_number=page_number, pages=1) as record:
+        text_blocks = text_layer_to_text_blocks(pdf_file[page_number].get_text('dict'), pdf_file_path, page_number)
+        record.update(instrumentation.text_blocks_counts(text_blocks))
+    else:
+      text_blocks = next(ocr_pages_text_blocks)
+    yield pandas.DataFrame(text_blocks)
     logging.info(f'Page {page_number+1} in {pdf_filename} completed')
+  ocr_pages_text_blocks.close() # shuts down the process pool, if one was started
   pdf_file.close()
-  df['centre_x'] = df.apply(lambda row: (row['left'] + row['right'])//2, axis=1)
-  df['centre_y'] = df.apply(lambda row: (row['bottom'] + row['top'])//2, axis=1)
-  
+
+def page_dfs_to_df(page_dfs):
+  df = pandas.concat(page_dfs)
+  df['centre_x'] = (df['left'] + df['right']) // 2
+  df['centre_y'] = (df['bottom'] + df['top']) // 2
   return df
-  
+
+def pdf_to_ocr_scanned_df(pdf_file_path, workers=None):
+  return page_dfs_to_df(list(pdf_to_page_dfs(pdf_file_path, workers)))
+
+# Streams the OCR output in DataFrames of up to batch_pages pages, so the whole document is never held in memory
+# Batches in which no text was found on any page are skipped
+def iter_ocr_page_batches(pdf_file_path, batch_pages, workers=None):
+  page_dfs = []
+  for page_df in pdf_to_page_dfs(pdf_file_path, workers):
+    page_dfs.append(page_df)
+    if len(page_dfs) == batch_pages:
+      if any(not page_df.empty for page_df in page_dfs):
+        yield page_dfs_to_df(page_dfs)
+      page_dfs = []
+  if any(not page_df.empty for page_df in page_dfs):
+    yield page_dfs_to_df(page_dfs)
@@ -0,0 +1,109 @@
+"""
+Persistent, content-addressed cache of OCR results, so re-running the pipeline while tuning downstream thresholds
+does not repeat layout detection and Tesseract OCR.
+Pages are keyed on a hash of their rendered pixmap together with the OCR-relevant config (ocr.*, detectron2.*),
+so a changed page or a changed OCR setting is simply a cache miss.
+Entries are stored in SQLite and the least-recently-used are evicted once the cache exceeds its size cap.
+"""
+
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import sqlite3
+import time
+from pathlib import Path
+
+from utils import load_config
+
+config = load_config()
+
+connection = None
+connection_pid = None  # connections must not be shared with forked process-pool workers
+
+# Shared with process-pool workers (see ocr.init_ocr_worker), so the main process can log totals for the run
+counters = {'hits': multiprocessing.Value('i', 0), 'misses': multiprocessing.Value('i', 0)}
+
+def is_enabled():
+  return config['ocr_cache']['enabled']
+
+def get_connection():
+  global connection, connection_pid
+  if connection is None or connection_pid != os.getpid():
+    cache_dir = Path(config['ocr_cache']['dir'])
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(cache_dir / 'ocr_cache.sqlite', timeout=60)
+    with connection:
+      connection.execute('CREATE TABLE IF NOT EXISTS ocr_cache (key TEXT PRIMARY KEY, text_blocks TEXT, size INTEGER, last_used REAL)')
+      connection.execute('CREATE INDEX IF NOT EXISTS ocr_cache_last_used ON ocr_cache (last_used)')
+      # The running total of entry sizes, so that puts only evict once the cache is over its cap, without summing the table
+      connection.execute('CREATE TABLE IF NOT EXISTS ocr_cache_size (id INTEGER PRIMARY KEY CHECK (id = 0), total_size INTEGER)')
+      connection.execute('INSERT OR IGNORE INTO ocr_cache_size VALUES (0, (SELECT COALESCE(SUM(size), 0) FROM ocr_cache))')
+    connection_pid = os.getpid()
+  return connection
+
+# Scheduling settings do not change OCR output, so they are left out of the key, as are the text-layer settings,
+# which only decide whether a page is OCR'd at all
+def page_key(pixmap_samples):
+  ocr_config = {k: v for k, v in config['ocr'].items() if k not in ('parallel', 'text_layer')}
+  detectron2_config = {k: v for k, v in config['detectron2'].items() if k != 'batch_size'}
+  key = hashlib.sha256(pixmap_samples)
+  key.update(json.dumps({'ocr': ocr_config, 'detectron2': detectron2_config}, sort_keys=True, default=str).encode())
+  return key.hexdigest()
+
+# Cached text blocks are stored without their PDF file and page number, so identical pages in other files also hit
+def get(key, pdf_filename, page_number):
+  db = get_connection()
+  row = db.execute('SELECT text_blocks FROM ocr_cache WHERE key = ?', (key,)).fetchone()
+  if row is None:
+    with counters['misses'].get_lock():
+      counters['misses'].value += 1
+    return None
+  with db:
+    db.execute('UPDATE ocr_cache SET last_used = ? WHERE key = ?', (time.time(), key))
+  with counters['hits'].get_lock():
+    counters['hits'].value += 1
+  return [{
+    'left': text_block['left'],
+    'top': text_block['top'],
+    'bottom': text_block['bottom'],
+    'right': text_block['right'],
+    'pdf_file': pdf_filename,
+    'page_number': page_number,
+    'text': text_block['text']
+  } for text_block in json.loads(row[0])]
+
+def put(key, text_blocks):
+  value = json.dumps([{k: v for k, v in text_block.items() if k not in ('pdf_file', 'page_number')} for text_block in text_blocks])
+  db = get_connection()
+  max_size = config['ocr_cache']['max_size_mb'] * 1024 * 1024
+  with db:
+    # The first write starts the transaction, so the total cannot change between these statements
+    db.execute('UPDATE ocr_cache_size SET total_size = total_size - COALESCE((SELECT size FROM ocr_cache WHERE key = ?), 0)', (key,))
+    db.execute('INSERT OR REPLACE INTO ocr_cache VALUES (?, ?, ?, ?)', (key, value, len(value), time.time()))
+    db.execute('UPDATE ocr_cache_size SET total_size = total_size + ?', (len(value),))
+    total_size = db.execute('SELECT total_size FROM ocr_cache_size').fetchone()[0]
+    if total_size > max_size:
+      # Evicts least-recently-used entries, read in last_used order from its index, until the cache is back under its cap
+      evicted_keys, evicted_size = [], 0
+      for evicted_key, size in db.execute('SELECT key, size FROM ocr_cache ORDER BY last_used'):
+        if total_size - evicted_size <= max_size:
+          break
+        evicted_keys.append((evicted_key,))
+        evicted_size += size
+      db.executemany('DELETE FROM ocr_cache WHERE key = ?', evicted_keys)
+      db.execute('UPDATE ocr_cache_size SET total_size = total_size - ?', (evicted_size,))
+
+def clear():
+  db = get_connection()
+  with db:
+    db.execute('DELETE FROM ocr_cache')
+    db.execute('UPDATE ocr_cache_size SET total_size = 0')
+  db.execute('VACUUM')
+  logging.info(f"OCR cache cleared: {config['ocr_cache']['dir']}")
+
+def log_stats():
+  hits, misses = counters['hits'].value, counters['misses'].value
+  if hits + misses:
+    logging.info(f'OCR cache: {hits} hits, {misses} misses ({hits / (hits + misses):.0%} hit rate)')
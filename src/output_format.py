@@ -13,8 +13,10 @@ Summary: <SUBHEADING>
 
 <ARTICLE BODY>
 """
+from pathlib import Path
+
 import regex as re
-from utils import config
+from utils import load_config
 
 DIVIDING_LINE = '\n-----------------------------------------------------\n'
 config = load_config()
@@ -54,10 +56,12 @@ Author: {df['author'].tolist()[0]}
 {article_text}
 """
 
+# Headers and footers have already been dropped by remove_headers_footers
+# pdf_file may hold the input PDF's path, so the output is named after its stem
 def df_to_formatted_docx(df, OUTPUT_PATH):
-  pdf_file = df['pdf_file'].values[0]
+  pdf_file = Path(df['pdf_file'].values[0]).stem
   # if an author, then do formatting, otherwise just df_to_string
-  text = '\n'.join( df[df['not_header_footer']==True].groupby('page_number').apply(format_page_df_to_string).tolist() )
+  text = '\n'.join( df.groupby('page_number').apply(format_page_df_to_string).tolist() )
 
   text = re.sub(r'([a-z,”])\n+([a-z])', r'\1 \2', text)
     # When sentences move across pages or blocks, (detected by lack of full stop or Capital letter) -> join together
@@ -65,3 +69,40 @@ def df_to_formatted_docx(df, OUTPUT_PATH):
 
   with open(OUTPUT_PATH+f'/{pdf_file}.docx', 'w', encoding='utf-8') as write_file:
     write_file.write(text)
+
+sentence_continues = re.compile(r'([a-z,”])\n+([a-z])')
+
+# Writes the same text as df_to_formatted_docx, one batch of pages at a time (headers and footers are already removed)
+# Trailing line-breaks are held back until the next batch, so sentences continuing across batches are still joined
+class FormattedDocxWriter:
+  def __init__(self, pdf_filename, OUTPUT_PATH):
+    self.write_file = open(OUTPUT_PATH+f'/{pdf_filename}.docx', 'w', encoding='utf-8')
+    self.started = False
+    self.pending_line_breaks = ''
+    self.last_char = ''
+    self.last_char_joined = False # a character already joined onto the previous line cannot start another join
+
+  def write(self, df):
+    text = '\n'.join(df.groupby('page_number').apply(format_page_df_to_string).tolist())
+    head = ''
+    if self.started:
+      text = self.pending_line_breaks + '\n' + text
+      boundary = re.match(r'\n+([a-z])', text)
+      if boundary and re.match(r'[a-z,”]', self.last_char) and not self.last_char_joined:
+        head = ' ' + boundary.group(1)
+        text = text[boundary.end():]
+    self.started = True
+
+    match_ends = [match.end() for match in sentence_continues.finditer(text)]
+    body = sentence_continues.sub(r'\1 \2', text).rstrip('\n')
+    self.pending_line_breaks = '\n' * (len(text) - len(text.rstrip('\n')))
+    if text.rstrip('\n'):
+      self.last_char = body[-1]
+      self.last_char_joined = bool(match_ends) and match_ends[-1] == len(text.rstrip('\n'))
+    elif head:
+      self.last_char, self.last_char_joined = head[-1], True
+    self.write_file.write(re.sub(config['paragraph_break_placeholder'], '', head + body))
+
+  def close(self):
+    self.write_file.write(self.pending_line_breaks)
+    self.write_file.close()
\ No newline at end of file
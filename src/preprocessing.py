@@ -1,23 +1,33 @@
 """
 Corrects errors in the OCR process.
-Errors in word boundaries (whether words are split or concatenated together) are corrected using Word Segment
+Errors in word boundaries (whether words are split or concatenated together) are corrected using Word Segment's language model,
+either with a Viterbi segmenter (see segmentation.py) or with Word Segment itself
 Spelling is corrected using JamSpell
 Initial Capitals (the large decorative capital letters which begin an article, commonly seen in magazines) are often 
 scanned as separate text-blocks; these are detected and concatenated to the rest of their articles
 Word Segment cannot handle punctuation or capital letters, these are removed and then replaced 
 while anticipating the change in word boundaries.
+Text correction is spread across a process pool, and recurring text (e.g. mastheads, section labels, bylines) is memoised.
 """
 
 import regex as re
 from textwrap import wrap 
 from itertools import zip_longest
-
-import jamspell
-import wordsegment
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+import logging
+import multiprocessing
+import time
+
+import numpy as np
+from segmentation import ViterbiSegmenter
 from utils import load_config
+import registry
 
-spell_checker = None
-config = None
+correction_pool = None
+stage_timings = Counter() # seconds spent in each text-correction stage, in this process
+config = load_config()
 
 punctuation_non_apostrophe = re.compile(r'[ ]?[^a-zA-Z\s’]+[ ]?|\n')
   # underscores, non-latin characters, all including spacing, faster, includes line-breaks to help segmentation (removed later)
@@ -30,84 +40,189 @@ remove_paragraph_break = re.compile(config['paragraph_break_placeholder'])
 reinsert_paragraph_break = re.compile('\1' + config['paragraph_break_placeholder'] + '\2')
 
 
-config['paragraph_break_placeholder']
-def __init__(self):
-  self.spell_checker = jamspell.TSpellCorrector()
-  self.spell_checker.LoadLangModel('en.bin')
+def load_spell_checker():
+  import jamspell
+  spell_checker = jamspell.TSpellCorrector()
+  spell_checker.LoadLangModel(config['jamspell_language_model'])
+  return spell_checker
+
+# Either engine is returned as an object whose segment() gives the list of words
+def load_word_segmenter():
+  if config['segmentation']['engine'] == 'viterbi':
+    return ViterbiSegmenter.load(config['segmentation']['table_path'], config['segmentation']['max_word_length'])
+  import wordsegment
   wordsegment.load()
-  self.config = load_config()
+  return wordsegment
+
+registry.register('spell_checker', load_spell_checker)
+registry.register('word_segmenter', load_word_segmenter)
 
+def init_models():
+  registry.warm_up(['spell_checker', 'word_segmenter'])
+
+# Initial capitals (single-character blocks) are added to the first block on the page containing their centre, or dropped
+# Blocks are bucketed into a grid of cells over the page, so each capital is only tested against the blocks overlapping its cell
 def remove_initial_capitals(page_df):
-  def is_inside_block(b1, b2): #Is the centre of block1 inside block2?
-    centre_x = (b1['right'] + b1['left'])//2
-    centre_y = (b1['bottom'] + b1['top'])//2
-    return b2['left'] < centre_x < b2['right'] and b2['top'] < centre_y < b2['bottom']
-
-  initial_caps = []
-  for i,row in page_df.iterrows():
-    if len(row['text'].strip())==1:
-      initial_caps.append(row)
-      page_df.drop(labels=i, axis=0, inplace=True)
-
-  for initial in initial_caps:
-    for i,row in page_df.iterrows():
-      if is_inside_block(initial, row):
-        page_df.at[i,'text'] = initial['text'].strip() + row['text'] # Add initial capital to text
-        break
+  is_initial_cap = page_df['text'].str.strip().str.len()==1
+  initial_caps, page_df = page_df[is_initial_cap], page_df[~is_initial_cap].copy()
+  if initial_caps.empty or page_df.empty:
+    return page_df
+
+  left, right, top, bottom = (page_df[side].to_numpy() for side in ['left', 'right', 'top', 'bottom'])
+  grid_size = int(np.ceil(np.sqrt(len(page_df)))) # cells per side, so a cell overlaps a few blocks on typical pages
+  x_min, x_extent = left.min(), max(right.max() - left.min() + 1, 1)
+  y_min, y_extent = top.min(), max(bottom.max() - top.min() + 1, 1)
+  cell_x = lambda x: np.clip((x - x_min) * grid_size // x_extent, 0, grid_size - 1)
+  cell_y = lambda y: np.clip((y - y_min) * grid_size // y_extent, 0, grid_size - 1)
+
+  # One (cell, block position) pair for every cell each block overlaps, sorted by cell with blocks in page order within a cell
+  first_x, first_y = cell_x(left), cell_y(top)
+  width, height = np.maximum(cell_x(right) - first_x + 1, 1), np.maximum(cell_y(bottom) - first_y + 1, 1) # at least one cell
+  cell_counts = width * height
+  block_positions = np.repeat(np.arange(len(page_df)), cell_counts)
+  offsets = np.arange(cell_counts.sum()) - np.repeat(np.cumsum(cell_counts) - cell_counts, cell_counts)
+  cells = (first_y[block_positions] + offsets // width[block_positions]) * grid_size + first_x[block_positions] + offsets % width[block_positions]
+  by_cell = np.argsort(cells, kind='stable')
+  cells, block_positions = cells[by_cell], block_positions[by_cell]
+
+  texts = page_df['text'].to_numpy(copy=True)
+  centres_x = ((initial_caps['right'] + initial_caps['left'])//2).to_numpy()
+  centres_y = ((initial_caps['bottom'] + initial_caps['top'])//2).to_numpy()
+  for initial, centre_x, centre_y in zip(initial_caps['text'].str.strip(), centres_x, centres_y):
+    cell = cell_y(centre_y) * grid_size + cell_x(centre_x)
+    candidates = block_positions[np.searchsorted(cells, cell, side='left'):np.searchsorted(cells, cell, side='right')]
+    is_inside_block = (left[candidates] < centre_x) & (centre_x < right[candidates]) & (top[candidates] < centre_y) & (centre_y < bottom[candidates])
+    if is_inside_block.any():
+      i = candidates[is_inside_block.argmax()] # the first containing block in page order
+      texts[i] = initial + texts[i] # Add initial capital to text
+  page_df['text'] = texts
   return page_df
 
+@lru_cache(maxsize=config['preprocessing']['cache_size'])
+def segment_chunk(s):
+  segmenter = registry.get('word_segmenter')
+  # wrap used to divide words into 200-char pieces, without splitting word boundaries (only wordsegment is limited in length)
+  if config['segmentation']['engine'] == 'viterbi' or len(s) < config['wordsegment_max_limit']:
+    return ' '.join(segmenter.segment(s))
+  return ' '.join([' '.join(segmenter.segment(ss)) for ss in wrap(s, config['wordsegment_max_limit'])])
+
 def fix_spacing_errors(text):
   punc = re.findall(punctuation_non_apostrophe, text) # Wordsegment doesn't work on punctuation -> removed before and added back after
-  # wrap used to divide words into 200-char pieces, without splitting word boundaries
-  words = [
-      ' '.join(wordsegment.segment(s))
-      if len(s) < config['wordsegment_max_limit']
-      else ' '.join([' '.join(wordsegment.segment(ss)) for ss in wrap(s, config['wordsegment_max_limit'])])
-    for s in re.split(punctuation_non_apostrophe, text) # Split text block by punctuation
-  ]
+  words = [segment_chunk(s) for s in re.split(punctuation_non_apostrophe, text)] # Split text block by punctuation
   punc = [p if p!='\n' else ' ' for p in punc] # filter out line-breaks
   uncapitalized = ''.join([(w or '')+(p or '') for w,p in zip_longest(words, punc)])
 
   # Wordsegment removes all capitalisation -> detect positions of capital letters in original string and reinsert in corrected one
-  caps = set()
-  apo,apo2 = [],[] #index of apostrophes, in string with no spaces and corrected-spaces respectively
+  # Apostrophes are reinserted after the same non-spacing character they followed, in a single pass over the corrected string
+  caps, apostrophes = set(), set() #indices of non-spacing characters which are capitals, or are followed by an apostrophe
 
   i = 0 #index of non-spacing characters
   for c in text:
     if c=='’':
-      apo.append(i)
+      apostrophes.add(i)
     if c.isspace() or c=='’':
       continue
     i+=1
     if c.isupper():
       caps.add(i)
 
-  capitalized = list(uncapitalized)
+  capitalized = []
   i = 0
-  for j,c in enumerate(uncapitalized):
+  for c in uncapitalized:
     if c.isspace():
+      capitalized.append(c)
       continue
     i += 1
-    if i in caps:
-      capitalized[j] = c.capitalize()
-    if i in apo:
-      apo2.append(j)
-
-  [capitalized.insert(idx+1,'’') for idx in reversed(apo2)]
+    capitalized.append(c.capitalize() if i in caps else c)
+    if i in apostrophes:
+      capitalized.append('’')
   return ''.join(capitalized)
 
+# Memoised on the normalised text
+@lru_cache(maxsize=config['preprocessing']['cache_size'])
+def correct_text(text):
+  start = time.perf_counter()
+  text = fix_spacing_errors(text)
+  stage_timings['segment'] += time.perf_counter() - start
+
+  start = time.perf_counter()
+  text = registry.get('spell_checker').FixFragment(text)
+  stage_timings['spell_check'] += time.perf_counter() - start
+  return text
+
 def process_text(text):
+  start = time.perf_counter()
   text = re.sub(remove_line_hyphenation, '', text)
   text = re.sub(paragraph_break, r'\1&&&\2', text)
   text = re.sub(reduce_whitespace, ' ', text).strip()
+  stage_timings['normalise'] += time.perf_counter() - start
 
-  text = fix_spacing_errors(text)
-  text = spell_checker.FixFragment(text)
+  text = correct_text(text)
 
   text = re.sub(reinsert_paragraph_break, '\n\n', text).strip()
   return text
 
+def correction_stats():
+  return Counter({
+    **stage_timings,
+    'correction_hits': correct_text.cache_info().hits,
+    'correction_misses': correct_text.cache_info().misses,
+    'segment_hits': segment_chunk.cache_info().hits,
+    'segment_misses': segment_chunk.cache_info().misses
+  })
+
+# Returns the corrected texts, with the timings and cache counts accumulated while correcting them
+def process_texts(texts):
+  stats_before = correction_stats()
+  texts = [process_text(text) for text in texts]
+  stats = correction_stats()
+  stats.subtract(stats_before)
+  return texts, stats
+
+# The parent's config is passed on, so that settings changed at runtime (e.g. by the benchmarks) reach the workers
+def init_correction_worker(parent_config):
+  config.update(parent_config)
+  init_models()
+
+# Workers load the JamSpell language model and wordsegment tables once, and are reused for every call
+# The pool is first needed after OCR has loaded torch and Detectron2, so its workers are spawned rather than forked
+# from a process with their threads running
+def get_correction_pool():
+  global correction_pool
+  if correction_pool is None:
+    correction_pool = ProcessPoolExecutor(max_workers=config['preprocessing']['workers'], mp_context=multiprocessing.get_context('spawn'),
+      initializer=init_correction_worker, initargs=(config,))
+  return correction_pool
+
+def shutdown_correction_pool():
+  global correction_pool
+  if correction_pool is not None:
+    correction_pool.shutdown()
+    correction_pool = None
+
+# Identical blocks are only corrected once, whichever worker they would be sent to
+def correct_texts(texts):
+  start = time.perf_counter()
+  unique_texts = list(dict.fromkeys(texts))
+  chunk_size = config['preprocessing']['chunk_size']
+  chunks = [unique_texts[i:i+chunk_size] for i in range(0, len(unique_texts), chunk_size)]
+  if config['preprocessing']['workers'] > 1:
+    results = list(get_correction_pool().map(process_texts, chunks))
+  else:
+    results = [process_texts(chunk) for chunk in chunks]
+
+  corrected_texts, stats = {}, Counter()
+  for chunk, (corrected_chunk, chunk_stats) in zip(chunks, results):
+    corrected_texts.update(zip(chunk, corrected_chunk))
+    stats.update(chunk_stats)
+  hit_rate = lambda hits, misses: hits / max(1, hits + misses)
+  logging.info(f'Text correction: {len(texts)} blocks ({len(unique_texts)} unique) in {time.perf_counter() - start:.1f}s; '
+    f"normalise {stats['normalise']:.1f}s, segment {stats['segment']:.1f}s, spell-check {stats['spell_check']:.1f}s (summed across workers); "
+    f"cache hit rates: corrected text {hit_rate(stats['correction_hits'], stats['correction_misses']):.0%}, "
+    f"segmented chunks {hit_rate(stats['segment_hits'], stats['segment_misses']):.0%}")
+  return [corrected_texts[text] for text in texts]
+
 def preprocessing(df):
-  df.groupby(['pdf_file','page_number'], group_keys=False).apply(remove_initial_capitals).dropna()
-  df['text'] = df.apply(lambda row: process_text(row['text']), axis=1)
+  df = df.groupby(['pdf_file','page_number'], group_keys=False).apply(remove_initial_capitals)
+  df['text'] = correct_texts(df['text'].tolist())
   return df
\ No newline at end of file
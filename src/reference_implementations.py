@@ -0,0 +1,90 @@
+"""
+The original row-by-row implementations of vectorised stages, kept as the reference their replacements must agree with,
+in the parity tests and the benchmarks
+"""
+
+import re
+
+import registry
+
+# The original row-by-row layout assignment, kept as the reference for the vectorised detect_page_layout
+def detect_page_layout_rowwise(df):
+  from detect_page_layout import column_centres, assign_column
+  def assign_layout_ordering_to_page_df(page_df):
+    error = {layout: 0 for layout in column_centres.keys()}
+    for layout in column_centres.keys():
+      page_df[layout] = 10
+    for i,text_block in page_df.iterrows():
+      for layout in column_centres.keys():
+        predicted_column = assign_column[layout](text_block['centre_x'])
+        page_df.at[i, layout] = predicted_column
+        error[layout] += abs(text_block['centre_x'] - column_centres[layout][predicted_column])
+    best_layout = sorted(error, key=error.get)[0]
+    page_df['column_position'] = page_df[best_layout]
+    return page_df.drop(column_centres.keys(), axis=1)
+  return df.groupby(['pdf_file','page_number'], group_keys=False).apply(assign_layout_ordering_to_page_df)
+
+# The original row-by-row header/footer filter and heading classification, kept as the reference for the columnar version
+# all() is given a list here; the original passed two arguments, which raises a TypeError
+def classify_heading_type_rowwise(df):
+  from detect_structure_elements import config_struct
+  df = df[df.apply(lambda row: all([row['top']<=config_struct['header_cutoff'], row['bottom']>=config_struct['footer_cutoff']]), axis=1)].copy()
+  def compute_pdf_font_stats(df):
+    chars_per_text_box = df['text'].apply(len)
+    df['pdf_font_size_avg'] = ( df['font_size'] * chars_per_text_box ).sum() // chars_per_text_box.sum()
+    df['pdf_font_size_std'] = df['font_size'].std()
+    return df
+  def compute_page_font_size_avg(page_df):
+    chars_per_text_box = page_df['text'].apply(len)
+    page_df['page_font_size_avg'] = sum(page_df['font_size'] * chars_per_text_box ) // chars_per_text_box.sum()
+    return page_df
+  def classify_heading_type_in_text_block(row):
+    font_size_Z_score_of_pdf_avg = round((row['font_size'] - row['pdf_font_size_avg']) / row['pdf_font_size_std'], 2)
+    if (row['font_size'] > config_struct['title_font_size_cutoff']):
+      return 0
+    elif (row['font_size'] > row['page_font_size_avg']) & (font_size_Z_score_of_pdf_avg >= config_struct['subheading_zscore_relative']):
+      return 1
+    else:
+      return 2
+  df['font_size'] = df.apply(lambda row: ((row['right'] - row['left']) * (row['bottom'] - row['top'])) // max(1, len(row['text'])), axis=1)
+  df = df.groupby(['pdf_file', 'page_number'], group_keys=False).apply(compute_page_font_size_avg)
+  df = df.groupby(['pdf_file'], group_keys=False).apply(compute_pdf_font_stats)
+  df['heading_type'] = df.apply(classify_heading_type_in_text_block, axis=1)
+  return df
+
+# The original page-by-page author detection (one NER call per page), kept as the reference for batched detection
+def detect_authors_per_page(df):
+  import ner
+  def detect_author_in_page(page_df):
+    if page_df[page_df['heading_type']==0].empty:
+      return ''
+    text = ner.df_to_string(page_df[page_df['heading_type']<2].sort_values(by='heading_type', kind='stable'), separator='. ')
+    if not re.search(ner.alphabetic_chars, text):
+      return ''
+    names = [tag['word'] for tag in registry.get('ner_classifier')(text.title()) if tag['entity_group']=='PER']
+    return ner.spell_check_author_name(ner.safe_get_first_elem(names))
+  authors = {page: detect_author_in_page(page_df) for page, page_df in df.groupby(['pdf_file', 'page_number'])}
+  return [authors[page] for page in zip(df['pdf_file'], df['page_number'])]
+
+# The original linear scan for the first author name within the score cutoff, kept as the reference for the trigram index
+def find_author_name_linear(names, author, score_cutoff):
+  from Levenshtein import ratio
+  return next((author_true for author_true in names if ratio(author_true, author, score_cutoff=score_cutoff)), None)
+
+# The original nested iterrows search for the block containing each initial capital, kept as the reference for the indexed version
+def remove_initial_capitals_rowwise(page_df):
+  def is_inside_block(b1, b2):
+    centre_x = (b1['right'] + b1['left'])//2
+    centre_y = (b1['bottom'] + b1['top'])//2
+    return b2['left'] < centre_x < b2['right'] and b2['top'] < centre_y < b2['bottom']
+  initial_caps = []
+  for i,row in page_df.iterrows():
+    if len(row['text'].strip())==1:
+      initial_caps.append(row)
+      page_df.drop(labels=i, axis=0, inplace=True)
+  for initial in initial_caps:
+    for i,row in page_df.iterrows():
+      if is_inside_block(initial, row):
+        page_df.at[i,'text'] = initial['text'].strip() + row['text']
+        break
+  return page_df
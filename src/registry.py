@@ -0,0 +1,63 @@
+"""
+Central registry of the pipeline's config and models, shared by every module in a process.
+config.yaml is parsed once, and each heavy model is loaded (and its libraries imported) only when it is first used.
+Loading is thread-safe: threads asking for a model while it is loading wait for it, and all share the one copy.
+Process-pool workers call warm_up() in their initializer, so that models are loaded before the worker takes any work.
+"""
+
+import logging
+import threading
+import time
+
+import yaml
+
+CONFIG_PATH = 'config.yaml'
+
+config = None
+loaders = {} # model name -> function which loads the model
+models = {}
+lock = threading.Lock() # guards parsing the config and creating the per-model locks
+model_locks = {}
+
+def get_config():
+  global config
+  if config is None:
+    with lock:
+      if config is None:
+        with open(CONFIG_PATH, 'r') as file:
+          config = yaml.safe_load(file)
+  return config
+
+def register(name, loader):
+  loaders[name] = loader
+
+def get_model_lock(name):
+  with lock:
+    return model_locks.setdefault(name, threading.Lock())
+
+def get(name):
+  if name not in models:
+    with get_model_lock(name):
+      if name not in models:
+        start = time.perf_counter()
+        models[name] = loaders[name]()
+        logging.info(f'{name} loaded in {time.perf_counter() - start:.1f}s')
+  return models[name]
+
+def is_loaded(name):
+  return name in models
+
+# Replaces a model without loading it, e.g. with a stub where the real model is unavailable
+def override(name, model):
+  models[name] = model
+
+def unload(name):
+  models.pop(name, None)
+
+def warm_up(names=None):
+  start = time.perf_counter()
+  names = [name for name in names or list(loaders) if not is_loaded(name)]
+  for name in names:
+    get(name)
+  if names:
+    logging.info(f'Warmed up {", ".join(names)} in {time.perf_counter() - start:.1f}s')
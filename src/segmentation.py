@@ -0,0 +1,148 @@
+"""
+Word segmentation of OCR text with missing spaces, using the same unigram and bigram language model as WordSegment.
+Rather than WordSegment's memoised recursion over every suffix of the text (which is limited to short inputs),
+the most likely segmentation is found with a single left-to-right Viterbi pass, so inputs of any length can be segmented whole.
+Log-probabilities are precomputed once from WordSegment's counts and saved as numpy arrays, which are memory-mapped
+when loaded, so every process-pool worker shares the one copy in the page cache rather than unpickling its own.
+The substrings of each input are looked up in the arrays in bulk, leaving only the Viterbi recursion itself in Python.
+"""
+
+import json
+import logging
+import math
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import regex as re
+
+non_alphanumeric = re.compile(r'[^a-z0-9]')
+
+TABLE_ARRAYS = ['vocabulary', 'unigram_log_probs', 'has_bigrams', 'bigram_keys', 'bigram_log_probs']
+
+class ViterbiSegmenter:
+  # vocabulary: sorted bytes of every word with a unigram or a bigram; unigram_log_probs: log10 probability of each word,
+  # or NaN for words only seen in bigrams; bigram_keys: sorted (previous word id * vocabulary size + word id), alongside
+  # bigram_log_probs: log10 conditional probability of the word given the previous word
+  def __init__(self, vocabulary, unigram_log_probs, has_bigrams, bigram_keys, bigram_log_probs, log_total, max_word_length):
+    self.vocabulary = vocabulary
+    self.unigram_log_probs = unigram_log_probs
+    self.has_bigrams = has_bigrams
+    self.bigram_keys = bigram_keys
+    self.bigram_log_probs = bigram_log_probs
+    self.log_total = log_total
+    self.max_word_length = max_word_length
+
+  # Scores match WordSegment's: bigrams are only used when the previous word is a known unigram, so the start of the
+  # text is scored by unigrams alone, and unknown words are penalised by their length
+  @classmethod
+  def from_counts(cls, unigrams, bigrams, total, max_word_length):
+    log_total = math.log10(total)
+    word_log_probs = {word: math.log10(count) - log_total for word, count in unigrams.items()}
+    bigram_log_probs = {}
+    for bigram, count in bigrams.items():
+      previous, word = bigram.split(' ')
+      if previous in word_log_probs:
+        bigram_log_probs[previous, word] = math.log10(count) - log_total - word_log_probs[previous]
+
+    vocabulary = np.array(sorted({word.encode() for word in word_log_probs} | {word.encode() for _, word in bigram_log_probs}))
+    word_ids = {word.decode(): i for i, word in enumerate(vocabulary)}
+    unigram_log_probs = np.full(len(vocabulary), np.nan)
+    unigram_log_probs[[word_ids[word] for word in word_log_probs]] = list(word_log_probs.values())
+    has_bigrams = np.zeros(len(vocabulary), dtype=bool)
+    has_bigrams[[word_ids[word] for _, word in bigram_log_probs]] = True
+    bigram_keys = np.array([word_ids[previous] * len(vocabulary) + word_ids[word] for previous, word in bigram_log_probs], dtype=np.int64)
+    by_key = np.argsort(bigram_keys)
+    return cls(vocabulary, unigram_log_probs, has_bigrams, bigram_keys[by_key],
+      np.array(list(bigram_log_probs.values()))[by_key], log_total, max_word_length)
+
+  # The table is written to a temporary directory which is renamed into place, so a partly written table is never loaded
+  def save(self, table_path):
+    table_path = Path(table_path)
+    table_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = Path(tempfile.mkdtemp(dir=table_path.parent, prefix=f'.{table_path.name}-'))
+    for name in TABLE_ARRAYS:
+      np.save(tmp_path / f'{name}.npy', getattr(self, name))
+    with open(tmp_path / 'meta.json', 'w') as f:
+      json.dump({'log_total': self.log_total}, f)
+    try:
+      os.replace(tmp_path, table_path)
+    except OSError: # saved meanwhile by another process
+      shutil.rmtree(tmp_path, ignore_errors=True)
+
+  @classmethod
+  def load(cls, table_path, max_word_length):
+    table_path = Path(table_path)
+    if not (table_path / 'meta.json').exists():
+      import wordsegment
+      wordsegment.load()
+      cls.from_counts(wordsegment.UNIGRAMS, wordsegment.BIGRAMS, wordsegment.Segmenter.TOTAL, max_word_length).save(table_path)
+      logging.info(f'Word segmentation table saved to {table_path}')
+    with open(table_path / 'meta.json') as f:
+      log_total = json.load(f)['log_total']
+    arrays = [np.load(table_path / f'{name}.npy', mmap_mode='r') for name in TABLE_ARRAYS]
+    return cls(*arrays, log_total, max_word_length)
+
+  # Vocabulary ids of every substring of the text, as word_ids[j, m - 1] for the substring of length m starting at j, or -1
+  def lookup_word_ids(self, text):
+    encoded = np.frombuffer(text.encode(), dtype=np.uint8)
+    word_ids = np.full((len(text), self.max_word_length), -1, dtype=np.int64)
+    for m in range(1, min(self.max_word_length, len(text)) + 1):
+      substrings = np.ascontiguousarray(np.lib.stride_tricks.sliding_window_view(encoded, m)).view(f'S{m}').ravel()
+      positions = np.minimum(np.searchsorted(self.vocabulary, substrings), len(self.vocabulary) - 1)
+      word_ids[:len(substrings), m - 1] = np.where(self.vocabulary[positions] == substrings, positions, -1)
+    return word_ids
+
+  # states[i] maps the start j of the last word of text[:i] to (best log-probability, start of the word before it)
+  # Only words with known bigrams need to look at each previous word, otherwise the best state at j is extended
+  def segment(self, text):
+    text = non_alphanumeric.sub('', text.lower())
+    if not text:
+      return []
+    max_word_length = self.max_word_length
+    word_ids = self.lookup_word_ids(text)
+    lengths = np.arange(1, max_word_length + 1)
+    is_known = word_ids >= 0
+    unigram_scores = np.where(is_known, self.unigram_log_probs[np.where(is_known, word_ids, 0)], np.nan)
+    unigram_scores = np.where(np.isnan(unigram_scores), 1 - self.log_total - lengths, unigram_scores)
+
+    # Bigram scores of each word with known bigrams (not at the start of the text), after each previous word
+    # bigram_scores[row, d - 1] scores the word after the previous word starting d characters before it
+    has_bigrams = is_known & self.has_bigrams[np.where(is_known, word_ids, 0)]
+    has_bigrams[0] = False
+    starts, word_lengths = np.nonzero(has_bigrams)
+    bigram_rows = np.full(word_ids.shape, -1)
+    bigram_rows[starts, word_lengths] = np.arange(len(starts))
+    previous_starts = starts[:, None] - lengths
+    previous_ids = word_ids[np.maximum(previous_starts, 0), lengths - 1]
+    keys = np.where((previous_starts >= 0) & (previous_ids >= 0), previous_ids * len(self.vocabulary) + word_ids[starts, word_lengths][:, None], -1)
+    positions = np.minimum(np.searchsorted(self.bigram_keys, keys), max(len(self.bigram_keys) - 1, 0))
+    is_bigram = (keys >= 0) & (self.bigram_keys[positions] == keys) if len(self.bigram_keys) else np.zeros(keys.shape, dtype=bool)
+    bigram_scores = np.where(is_bigram, self.bigram_log_probs[positions] if len(self.bigram_keys) else 0.0,
+      unigram_scores[starts, word_lengths][:, None]).tolist()
+    unigram_scores, bigram_rows = unigram_scores.tolist(), bigram_rows.tolist()
+
+    states = [{-1: (0.0, None)}] + [None] * len(text)
+    best_state = [(0.0, -1)] + [None] * len(text) # (log-probability, start of last word) of the best state at each position
+    for i in range(1, len(text) + 1):
+      states[i] = {}
+      for j in range(max(0, i - max_word_length), i):
+        row = bigram_rows[j][i - j - 1]
+        if row >= 0:
+          # A known bigram replaces the unigram score, so every previous word must be considered
+          scores = bigram_scores[row]
+          states[i][j] = max((previous_log_prob + scores[j - k - 1], k) for k, (previous_log_prob, _) in states[j].items())
+        else:
+          best_log_prob, best_previous_start = best_state[j]
+          states[i][j] = (best_log_prob + unigram_scores[j][i - j - 1], best_previous_start)
+      best_start = max(states[i], key=lambda j: states[i][j][0])
+      best_state[i] = (states[i][best_start][0], best_start)
+
+    words = []
+    i, j = len(text), best_state[len(text)][1]
+    while i > 0:
+      words.append(text[j:i])
+      i, j = j, states[i][j][1]
+    return words[::-1]
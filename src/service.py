@@ -0,0 +1,154 @@
+"""
+Long-running service mode, which keeps the models loaded between jobs so that single-issue jobs are not dominated by startup.
+A job is submitted by placing a PDF in <spool_dir>/incoming. Only '*.pdf' names are picked up, so clients should write the file
+under another name (e.g. '<job>.pdf.part') and rename it once complete.
+Each job's progress is written to <spool_dir>/status/<job>.json: queued -> running -> done or failed.
+Outputs are written to a temporary directory which is renamed to <spool_dir>/done/<job> once complete; failed PDFs are moved to failed/.
+At most queue_size jobs wait for the worker pool, beyond which PDFs are left in incoming until there is room.
+A PDF named like a job that is still queued or running is likewise left in incoming until that job finishes.
+Run from the repository root: python src/service.py
+"""
+
+import json
+import logging
+import os
+import shutil
+import signal
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from utils import load_config
+
+config = load_config()
+
+SPOOL_SUBDIRS = ['incoming', 'processing', 'status', 'done', 'failed', 'tmp']
+
+def spool_paths(spool_dir):
+  return {name: Path(spool_dir) / name for name in SPOOL_SUBDIRS}
+
+# Written to a temporary file and renamed over the old status, so readers never see a partly written status
+def write_status(spool_dir, job_id, state, **fields):
+  status_dir = spool_paths(spool_dir)['status']
+  tmp_path = status_dir / f'.{job_id}.json.tmp'
+  with open(tmp_path, 'w', encoding='utf-8') as f:
+    json.dump({'job': job_id, 'state': state, 'time': time.time(), **fields}, f)
+  os.replace(tmp_path, status_dir / f'{job_id}.json')
+
+def read_status(spool_dir, job_id):
+  try:
+    with open(spool_paths(spool_dir)['status'] / f'{job_id}.json', encoding='utf-8') as f:
+      return json.load(f)
+  except FileNotFoundError:
+    return None
+
+# Each worker loads every model once, before it takes any job
+# Jobs already run in parallel across workers, so each job's OCR and text correction run serially within its worker
+def init_service_worker():
+  import ner
+  import ocr
+  import preprocessing
+  config['ocr']['parallel']['workers'] = 1
+  config['preprocessing']['workers'] = 1
+  ocr.init_models()
+  preprocessing.init_models()
+  ner.init_models()
+
+def run_job(spool_dir, job_id, pdf_file_path):
+  from main import process_pdf
+  paths = spool_paths(spool_dir)
+  write_status(spool_dir, job_id, 'running', pid=os.getpid())
+  start = time.perf_counter()
+  output_tmp_dir = Path(tempfile.mkdtemp(dir=paths['tmp'], prefix=f'{job_id}-'))
+  try:
+    process_pdf(pdf_file_path, output_tmp_dir)
+    output_dir = paths['done'] / job_id
+    if output_dir.exists(): # a resubmitted job replaces its earlier outputs
+      shutil.rmtree(output_dir)
+    os.replace(output_tmp_dir, output_dir)
+    Path(pdf_file_path).unlink()
+    write_status(spool_dir, job_id, 'done', seconds=time.perf_counter() - start, output_dir=str(output_dir))
+    logging.info(f'Job {job_id} done in {time.perf_counter() - start:.1f}s')
+  except Exception as e:
+    logging.exception(f'Job {job_id} failed: {e}')
+    shutil.rmtree(output_tmp_dir, ignore_errors=True)
+    os.replace(pdf_file_path, paths['failed'] / Path(pdf_file_path).name)
+    write_status(spool_dir, job_id, 'failed', seconds=time.perf_counter() - start, error=repr(e))
+  return job_id
+
+class Service:
+  def __init__(self, spool_dir=None, workers=None, queue_size=None):
+    self.spool_dir = Path(spool_dir or config['service']['spool_dir'])
+    self.paths = spool_paths(self.spool_dir)
+    for path in self.paths.values():
+      path.mkdir(parents=True, exist_ok=True)
+    self.workers = workers or config['service']['workers']
+    # A slot is taken by every job claimed from incoming and released when it finishes, which bounds the queue
+    self.slots = threading.BoundedSemaphore(self.workers + (queue_size if queue_size is not None else config['service']['queue_size']))
+    self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=init_service_worker)
+    self.stopping = threading.Event()
+    self.requeue_interrupted_jobs()
+
+  # Jobs claimed by a service which stopped before finishing them are returned to incoming
+  def requeue_interrupted_jobs(self):
+    for pdf_file_path in self.paths['processing'].glob('*.pdf'):
+      os.replace(pdf_file_path, self.paths['incoming'] / pdf_file_path.name)
+      logging.info(f'Requeued interrupted job {pdf_file_path.stem}')
+
+  # run_job records its own failures, so an exception here means the worker process died
+  def job_finished(self, future, job_id):
+    self.slots.release()
+    if not future.cancelled() and future.exception() is not None:
+      write_status(self.spool_dir, job_id, 'failed', error=repr(future.exception()))
+
+  # Oldest submissions first. Renaming into processing is atomic, so a PDF is claimed exactly once
+  # A PDF named like a job still in processing is left in incoming until that job finishes, as it would replace the job's input
+  def claim_jobs(self):
+    incoming = sorted(self.paths['incoming'].glob('*.pdf'), key=lambda path: path.stat().st_mtime)
+    for pdf_file_path in incoming:
+      if not self.slots.acquire(blocking=False):
+        return
+      job_id = pdf_file_path.stem
+      job_path = self.paths['processing'] / pdf_file_path.name
+      if job_path.exists():
+        self.slots.release()
+        continue
+      try:
+        os.replace(pdf_file_path, job_path)
+      except FileNotFoundError:
+        self.slots.release()
+        continue
+      write_status(self.spool_dir, job_id, 'queued')
+      future = self.executor.submit(run_job, str(self.spool_dir), job_id, str(job_path))
+      future.add_done_callback(lambda future, job_id=job_id: self.job_finished(future, job_id))
+
+  # One task per worker starts every worker process, and each runs its initializer before its first task
+  def warm_up(self):
+    start = time.perf_counter()
+    for future in [self.executor.submit(os.getpid) for _ in range(self.workers)]:
+      future.result()
+    logging.info(f'Workers warmed up in {time.perf_counter() - start:.1f}s')
+
+  # Jobs still waiting when the service stops are cancelled, and requeued when it next starts
+  def serve_forever(self):
+    self.warm_up()
+    logging.info(f'Serving jobs from {self.paths["incoming"]}')
+    while not self.stopping.is_set():
+      self.claim_jobs()
+      self.stopping.wait(config['service']['poll_interval'])
+    self.executor.shutdown(wait=True, cancel_futures=True)
+
+  def stop(self):
+    self.stopping.set()
+
+def main():
+  logging.basicConfig(level=logging.INFO)
+  service = Service()
+  for signal_number in [signal.SIGINT, signal.SIGTERM]:
+    signal.signal(signal_number, lambda signal_number, frame: service.stop())
+  service.serve_forever()
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,140 @@
+"""
+Synthetic documents and DataFrames shared by the benchmarks and tests, so that stages can be exercised without real scans
+Magazine-style PDFs are generated with PyMuPDF (2, 3 or 4 columns, headers, footers, titles, bylines and initial capitals),
+alongside the ground truth text blocks of each page
+"""
+
+import random
+
+from utils import load_config
+
+config = load_config()
+
+COLUMN_COUNTS = [2, 3, 4]
+WORDS = ('the of and to in a is that for it as was with be by on not he this are or his from at which but have an they you were '
+  'garden river winter village market letter school bridge history season harbour journey festival').split()
+FIRST_NAMES = ['Margaret', 'Thomas', 'Sarah', 'Daniel', 'Priya', 'Kenji', 'Helen', 'Aisling']
+LAST_NAMES = ['Ellison', 'Okafor', 'Lindqvist', 'Reyes', 'Natarajan', 'Watanabe', 'Marsh', 'Moreau']
+
+def random_text(rng, char_count):
+  words = []
+  while sum(len(word) + 1 for word in words) < char_count:
+    words.append(rng.choice(WORDS))
+  return ' '.join(words).capitalize() + '.'
+
+# Roughly 70% of the characters which fit in the rectangle, as insert_textbox writes nothing when text overflows
+def text_capacity(rect, fontsize):
+  return int(0.7 * (rect.width / (fontsize * 0.5)) * (rect.height / (fontsize * 1.2)))
+
+# Returns the ground truth text blocks of each page, in the pixel coordinates of the OCR'd page images
+# Pages alternate between starting an article (title, byline and an initial capital) and continuing one
+# Given a dpi, each page is rasterised so that it has to be OCR'd; otherwise the born-digital PDF, with its text layer, is saved
+def make_synthetic_pdf(pdf_file_path, page_count, dpi=None, seed=0):
+  import fitz
+  rng = random.Random(seed)
+  zoom = 300 * config['ocr']['scale_factor'] / 72
+  text_pdf, scanned_pdf = fitz.open(), fitz.open()
+  pages_text_blocks = []
+  for page_number in range(page_count):
+    page = text_pdf.new_page()
+    text_blocks = []
+    def add_text_block(rect, text, fontsize, text_rect=None):
+      page.insert_textbox(text_rect or rect, text, fontsize=fontsize)
+      text_blocks.append({'rect': rect, 'text': text})
+
+    add_text_block(fitz.Rect(72, 20, 540, 34), f'The Synthetic Review | Issue {page_number // 32 + 1}', 8)
+    add_text_block(fitz.Rect(290, page.rect.height - 34, 330, page.rect.height - 20), str(page_number + 1), 8)
+    starts_article = page_number % 2 == 0
+    body_top = 72
+    if starts_article:
+      add_text_block(fitz.Rect(72, 50, 540, 90), ' '.join(rng.choice(WORDS) for _ in range(4)).title(), 24)
+      add_text_block(fitz.Rect(72, 96, 540, 112), f'By {rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}', 11)
+      body_top = 124
+
+    columns = COLUMN_COUNTS[page_number % len(COLUMN_COUNTS)]
+    column_width = (page.rect.width - 144) / columns
+    for column in range(columns):
+      rect = fitz.Rect(72 + column * column_width, body_top, 60 + (column + 1) * column_width, page.rect.height - 60)
+      if starts_article and column == 0: # the body text starts below the initial capital, whose centre lies inside the body's block
+        initial_rect = fitz.Rect(rect.x0, rect.y0, rect.x0 + 30, rect.y0 + 40)
+        add_text_block(initial_rect, rng.choice('ABCDEFGHIJKLMNOPRSTW'), 32)
+        text_rect = fitz.Rect(rect.x0, rect.y0 + 44, rect.x1, rect.y1)
+        add_text_block(rect, random_text(rng, text_capacity(text_rect, 9)), 9, text_rect)
+      else:
+        add_text_block(rect, random_text(rng, text_capacity(rect, 9)), 9)
+
+    if dpi:
+      pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+      scanned_page = scanned_pdf.new_page(width=page.rect.width, height=page.rect.height)
+      scanned_page.insert_image(scanned_page.rect, pixmap=pix)
+    pages_text_blocks.append([{
+      'left': int(text_block['rect'].x0 * zoom),
+      'top': int(text_block['rect'].y0 * zoom),
+      'bottom': int(text_block['rect'].y1 * zoom),
+      'right': int(text_block['rect'].x1 * zoom),
+      'pdf_file': str(pdf_file_path),
+      'page_number': page_number,
+      'text': text_block['text']
+    } for text_block in text_blocks])
+  (scanned_pdf if dpi else text_pdf).save(pdf_file_path)
+  text_pdf.close()
+  scanned_pdf.close()
+  return pages_text_blocks
+
+# Pages of 2 to 4 columns of blocks at random heights, across two PDFs
+def make_synthetic_blocks_df(block_count, blocks_per_page=40):
+  import numpy as np
+  import pandas
+  rng = np.random.default_rng(0)
+  page_number = np.arange(block_count) // blocks_per_page
+  column_count = rng.integers(2, 5, size=page_number.max() + 1)[page_number]
+  column = rng.integers(0, column_count)
+  column_width = 540 // column_count
+  left = 30 + column * column_width + rng.integers(0, 10, size=block_count)
+  right = left + column_width - rng.integers(10, 30, size=block_count)
+  top = rng.integers(40, 800, size=block_count)
+  bottom = top + rng.integers(10, 200, size=block_count)
+  df = pandas.DataFrame({
+    'left': left,
+    'top': top,
+    'bottom': bottom,
+    'right': right,
+    'pdf_file': np.where(page_number < page_number.max() // 2, 'issue_1.pdf', 'issue_2.pdf'),
+    'page_number': page_number,
+    'text': [' '.join(WORDS[i % len(WORDS)] for i in range(n)) for n in rng.integers(1, 120, size=block_count)]
+  })
+  df['centre_x'] = (df['left'] + df['right']) // 2
+  df['centre_y'] = (df['bottom'] + df['top']) // 2
+  return df
+
+# Pages of many text blocks, where some blocks are replaced by initial capitals placed at the top-left of another block
+def make_synthetic_initial_caps_df(block_count, blocks_per_page, initial_caps_per_page):
+  import numpy as np
+  df = make_synthetic_blocks_df(block_count, blocks_per_page).drop(columns=['centre_x', 'centre_y'])
+  rng = np.random.default_rng(1)
+  for page_start in range(0, block_count, blocks_per_page):
+    page_index = df.index[page_start:page_start + blocks_per_page]
+    for initial, block in rng.choice(page_index, size=(min(initial_caps_per_page, len(page_index) // 2), 2), replace=False):
+      left, top = df.at[block, 'left'], df.at[block, 'top']
+      df.loc[initial, ['left', 'top', 'right', 'bottom', 'text']] = [left, top, left + 20, top + 20, rng.choice(list('ABCDEFGHIJ'))]
+  return df
+
+# A roster of random two-part names, and queries which are each a roster name with one character changed
+def make_synthetic_author_names(name_count, query_count):
+  rng = random.Random(0)
+  syllables = ['an', 'bel', 'cor', 'da', 'el', 'fin', 'gar', 'ha', 'is', 'jo', 'ka', 'lin', 'mor', 'na', 'or', 'pe', 'ri', 'son', 'ta', 'vi']
+  make_part = lambda: ''.join(rng.choice(syllables) for _ in range(rng.randint(2, 4))).capitalize()
+  names = sorted({f'{make_part()} {make_part()}' for _ in range(name_count)})
+  queries = []
+  for name in rng.sample(names, query_count):
+    i = rng.randrange(len(name))
+    queries.append(name[:i] + rng.choice('abcdefghijklmnopqrstuvwxyz') + name[i+1:])
+  return names, queries
+
+# Unspaced runs of common words, as OCR produces when word spacing is lost; the reference segmentation is the original words
+def make_synthetic_segmentation_corpus(block_count):
+  import wordsegment
+  wordsegment.load()
+  rng = random.Random(0)
+  vocabulary = sorted(wordsegment.UNIGRAMS, key=wordsegment.UNIGRAMS.get, reverse=True)[:5000]
+  return [' '.join(rng.choice(vocabulary) for _ in range(rng.randint(5, 400))) for _ in range(block_count)]
@@ -1,7 +1,8 @@
 import logging
 import pickle
 import fitz
-import yaml
+
+import registry
 
 def load_model(model, model_name):
   try:
@@ -41,7 +42,6 @@ def load_pkl_file(file_path):
     logging.exception(f"Unexpected error loading file {file_path}: {e}")
   return None
 
+# Parsed once per process and shared by every module, see registry.py
 def load_config():
-  with open('config.yaml', 'r') as file:
-    config = yaml.safe_load(file)
-  return config
\ No newline at end of file
+  return registry.get_config()
\ No newline at end of file
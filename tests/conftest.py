@@ -0,0 +1,9 @@
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / 'src'))
+
+# The pipeline's modules read config.yaml relative to the working directory, so tests can be run from anywhere
+import registry
+registry.CONFIG_PATH = str(ROOT / 'config.yaml')
@@ -0,0 +1,15 @@
+from detect_page_layout import detect_page_layout
+from reference_implementations import detect_page_layout_rowwise
+from synthetic import make_synthetic_blocks_df
+
+def assert_same_columns(df):
+  expected = detect_page_layout_rowwise(df.copy()).sort_index()
+  actual = detect_page_layout(df.copy()).sort_index()
+  assert actual.index.equals(expected.index)
+  assert actual['column_position'].tolist() == expected['column_position'].tolist()
+
+def test_matches_rowwise_on_multi_column_pages():
+  assert_same_columns(make_synthetic_blocks_df(2000))
+
+def test_matches_rowwise_on_single_block_pages():
+  assert_same_columns(make_synthetic_blocks_df(50, blocks_per_page=1))
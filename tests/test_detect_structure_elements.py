@@ -0,0 +1,11 @@
+from detect_structure_elements import classify_heading_type, remove_headers_footers
+from reference_implementations import classify_heading_type_rowwise
+from synthetic import make_synthetic_blocks_df
+
+def test_matches_rowwise_header_footer_filter_and_heading_types():
+  df = make_synthetic_blocks_df(3000).reset_index(drop=True)
+  expected = classify_heading_type_rowwise(df.copy()).sort_index()
+  actual = classify_heading_type(remove_headers_footers(df.copy()).copy()).sort_index()
+  assert actual.index.equals(expected.index)
+  assert actual['font_size'].tolist() == expected['font_size'].tolist()
+  assert actual['heading_type'].tolist() == expected['heading_type'].tolist()
@@ -0,0 +1,24 @@
+from Levenshtein import ratio
+
+from ner import AuthorNamesIndex
+from reference_implementations import find_author_name_linear
+from synthetic import make_synthetic_author_names
+
+SCORE_CUTOFF = 0.9
+
+# The index returns the best match, which may score higher than the first match found by the linear scan
+def test_index_matches_as_well_as_linear_scan():
+  names, queries = make_synthetic_author_names(2000, 100)
+  index = AuthorNamesIndex(names)
+  for query in queries:
+    linear = find_author_name_linear(names, query, SCORE_CUTOFF)
+    indexed = index.best_match(query, SCORE_CUTOFF)
+    if linear is None:
+      assert indexed is None
+    else:
+      assert indexed is not None and ratio(indexed, query) >= ratio(linear, query)
+
+def test_exact_and_unmatched_names():
+  index = AuthorNamesIndex(['Margaret Ellison', 'Thomas Okafor'])
+  assert index.best_match('Margaret Ellison', SCORE_CUTOFF) == 'Margaret Ellison'
+  assert index.best_match('Completely Different', SCORE_CUTOFF) is None
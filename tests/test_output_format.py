@@ -0,0 +1,45 @@
+import random
+from pathlib import Path
+
+import pytest
+
+from detect_page_layout import detect_page_layout
+from detect_structure_elements import classify_heading_type, remove_headers_footers
+from output_format import FormattedDocxWriter, config, df_to_formatted_docx
+from synthetic import make_synthetic_blocks_df
+
+# One PDF's classified and ordered blocks, whose text starts and ends in ways which do and do not join across pages
+@pytest.fixture
+def ordered_df():
+  rng = random.Random(0)
+  df = make_synthetic_blocks_df(600, blocks_per_page=12)
+  df = df[df['pdf_file'] == df['pdf_file'].iloc[0]].copy()
+  placeholder = config['paragraph_break_placeholder']
+  df['text'] = [rng.choice(['', 'Starts a sentence. ', '“Quoted” ']) + text + rng.choice(['', '.', ',', '”', '\n', placeholder])
+    for text in df['text']]
+  df = detect_page_layout(classify_heading_type(remove_headers_footers(df)))
+  df['author'] = ''
+  return df.sort_values(by=['pdf_file', 'page_number', 'heading_type', 'column_position', 'centre_y'])
+
+def write_batches(df, output_dir, batch_pages):
+  writer = FormattedDocxWriter('streamed', str(output_dir))
+  page_numbers = sorted(df['page_number'].unique())
+  for start in range(0, len(page_numbers), batch_pages):
+    writer.write(df[df['page_number'].isin(page_numbers[start:start + batch_pages])])
+  writer.close()
+  return (output_dir / 'streamed.docx').read_text(encoding='utf-8')
+
+@pytest.mark.parametrize('batch_pages', [1, 2, 3, 7])
+def test_batches_match_whole_document(ordered_df, tmp_path, batch_pages):
+  df_to_formatted_docx(ordered_df, str(tmp_path))
+  whole_document = (tmp_path / f"{Path(ordered_df['pdf_file'].iloc[0]).stem}.docx").read_text(encoding='utf-8')
+  assert write_batches(ordered_df, tmp_path, len(ordered_df)) == whole_document
+  assert write_batches(ordered_df, tmp_path, batch_pages) == whole_document
+
+# Formatted pages start with a dividing line or '+', so sentences never run on across pages; with pages formatted as their bare
+# text, they do, which exercises joining sentences across batch boundaries
+@pytest.mark.parametrize('batch_pages', [1, 2, 3, 7])
+def test_batches_match_whole_document_across_page_joins(ordered_df, tmp_path, batch_pages, monkeypatch):
+  import output_format
+  monkeypatch.setattr(output_format, 'format_page_df_to_string', output_format.df_to_string)
+  test_batches_match_whole_document(ordered_df, tmp_path, batch_pages)
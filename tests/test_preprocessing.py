@@ -0,0 +1,27 @@
+import random
+
+import pandas
+
+from preprocessing import remove_initial_capitals
+from reference_implementations import remove_initial_capitals_rowwise
+from synthetic import make_synthetic_initial_caps_df
+
+def assert_same_blocks(df):
+  expected = df.copy().groupby(['pdf_file', 'page_number'], group_keys=False).apply(remove_initial_capitals_rowwise).sort_index()
+  actual = df.copy().groupby(['pdf_file', 'page_number'], group_keys=False).apply(remove_initial_capitals).sort_index()
+  assert actual.index.equals(expected.index)
+  assert actual['text'].tolist() == expected['text'].tolist()
+
+def test_matches_rowwise_on_synthetic_pages():
+  assert_same_blocks(make_synthetic_initial_caps_df(2000, blocks_per_page=200, initial_caps_per_page=10))
+
+# Small pages of overlapping, nested and degenerate blocks, where several capitals may fall in one block or in none
+def test_matches_rowwise_on_random_pages():
+  rng = random.Random(1)
+  rows = []
+  for page_number in range(500):
+    for _ in range(rng.randint(0, 12)):
+      left, top = rng.randint(0, 100), rng.randint(0, 100)
+      rows.append({'pdf_file': 'issue', 'page_number': page_number, 'left': left, 'right': left + rng.randint(-3, 60),
+        'top': top, 'bottom': top + rng.randint(-3, 60), 'text': rng.choice(['A', 'B ', 'word', 'two words'])})
+  assert_same_blocks(pandas.DataFrame(rows))
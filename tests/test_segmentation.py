@@ -0,0 +1,66 @@
+import math
+import random
+from functools import lru_cache
+
+import pytest
+
+from segmentation import ViterbiSegmenter
+
+VOCABULARY = ['a', 'an', 'the', 'cat', 'at', 'he', 'hat', 't', 'ca', 'th', 'ant', 'ea', 'cath', 'e']
+TOTAL = 5000.0
+
+def make_counts(rng):
+  unigrams = {word: rng.randint(1, 1000) for word in rng.sample(VOCABULARY, 10)}
+  words = list(unigrams)
+  bigrams = {f'{rng.choice(words)} {rng.choice(words)}': rng.randint(1, 500) for _ in range(15)}
+  return unigrams, bigrams
+
+# WordSegment's scoring and memoised search over every split of the text, as the reference
+def make_wordsegment_search(unigrams, bigrams):
+  def score(word, previous=None):
+    if previous is None:
+      return unigrams[word] / TOTAL if word in unigrams else 10.0 / (TOTAL * 10 ** len(word))
+    bigram = f'{previous} {word}'
+    if bigram in bigrams and previous in unigrams:
+      return bigrams[bigram] / TOTAL / score(previous)
+    return score(word)
+
+  @lru_cache(maxsize=None)
+  def search(text, previous='<s>'):
+    if not text:
+      return 0.0
+    return max(math.log10(score(text[:i], previous)) + search(text[i:], text[:i]) for i in range(1, min(len(text), 24) + 1))
+
+  def log_prob(words):
+    total, previous = 0.0, '<s>'
+    for word in words:
+      total += math.log10(score(word, previous))
+      previous = word
+    return total
+  return search, log_prob
+
+# Ties between segmentations of equal probability may be broken differently, so the probabilities are compared
+def test_finds_most_likely_segmentation():
+  rng = random.Random(3)
+  for _ in range(200):
+    unigrams, bigrams = make_counts(rng)
+    segmenter = ViterbiSegmenter.from_counts(unigrams, bigrams, TOTAL, 24)
+    search, log_prob = make_wordsegment_search(unigrams, bigrams)
+    text = ''.join(rng.choice(['cat', 'the', 'hat', 'an', 'eat', 'a', 'ant']) for _ in range(rng.randint(1, 6)))
+    words = segmenter.segment(text)
+    assert ''.join(words) == text
+    assert log_prob(words) == pytest.approx(search(text), abs=1e-6)
+
+def test_saved_table_segments_identically(tmp_path):
+  rng = random.Random(0)
+  unigrams, bigrams = make_counts(rng)
+  segmenter = ViterbiSegmenter.from_counts(unigrams, bigrams, TOTAL, 24)
+  segmenter.save(tmp_path / 'table')
+  loaded = ViterbiSegmenter.load(tmp_path / 'table', 24)
+  for text in ['thecatatthehat', 'anantateacathat', 'zzzthe', 'a']:
+    assert loaded.segment(text) == segmenter.segment(text)
+
+def test_normalises_and_handles_empty_text():
+  segmenter = ViterbiSegmenter.from_counts({'the': 10, 'cat': 5}, {'the cat': 3}, TOTAL, 24)
+  assert segmenter.segment('') == []
+  assert segmenter.segment('The, Cat!') == ['the', 'cat']
@@ -0,0 +1,169 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+
+import main
+import service
+from service import Service, read_status, spool_paths
+
+MODEL_LOAD_SECONDS = 0.5
+
+# Stands in for main.process_pdf: records the input it was given, waits while its job's gate is closed,
+# fails on PDFs named 'bad*', and otherwise writes one output file
+class StandInPipeline:
+  def __init__(self):
+    self.gates = {}
+    self.started = {}
+    self.inputs = []
+
+  def close_gate(self, job_id):
+    self.gates[job_id] = threading.Event()
+    self.started[job_id] = threading.Event()
+
+  def process_pdf(self, pdf_file_path, OUTPUT_DIR):
+    job_id = Path(pdf_file_path).stem
+    self.inputs.append(Path(pdf_file_path).read_bytes())
+    if job_id in self.gates:
+      self.started[job_id].set()
+      self.gates[job_id].wait(10)
+    if job_id.startswith('bad'):
+      raise RuntimeError('unreadable PDF')
+    (Path(OUTPUT_DIR) / f'{job_id}.docx').write_text('output', encoding='utf-8')
+
+# Workers are threads of the test process, so that they see the stand-in pipeline, and loading the models is replaced by a sleep
+@pytest.fixture
+def pipeline(monkeypatch):
+  pipeline = StandInPipeline()
+  monkeypatch.setattr(main, 'process_pdf', pipeline.process_pdf)
+  monkeypatch.setattr(service, 'ProcessPoolExecutor', ThreadPoolExecutor)
+  monkeypatch.setattr(service, 'init_service_worker', lambda: time.sleep(MODEL_LOAD_SECONDS))
+  monkeypatch.setitem(service.config['service'], 'poll_interval', 0.01)
+  yield pipeline
+  for gate in pipeline.gates.values():
+    gate.set()
+
+@pytest.fixture
+def make_service(pipeline, tmp_path):
+  services = []
+  def make_service(workers, queue_size):
+    services.append(Service(tmp_path / 'spool', workers=workers, queue_size=queue_size))
+    return services[-1]
+  yield make_service
+  for gate in pipeline.gates.values():
+    gate.set()
+  for started_service in services:
+    started_service.executor.shutdown(wait=True)
+
+# Written under a temporary name and renamed, as a client would
+def submit(spool_dir, job_id, content=b'%PDF-1.7'):
+  incoming = spool_paths(spool_dir)['incoming']
+  (incoming / f'{job_id}.pdf.part').write_bytes(content)
+  os.replace(incoming / f'{job_id}.pdf.part', incoming / f'{job_id}.pdf')
+
+def state(spool_dir, job_id):
+  status = read_status(spool_dir, job_id)
+  return status and status['state']
+
+def wait_for(condition, timeout=10):
+  deadline = time.perf_counter() + timeout
+  while not condition():
+    assert time.perf_counter() < deadline, 'timed out'
+    time.sleep(0.01)
+
+def pdf_names(path):
+  return sorted(pdf_file_path.name for pdf_file_path in path.glob('*.pdf'))
+
+def test_job_goes_from_queued_to_running_to_done(pipeline, make_service):
+  job_service = make_service(workers=1, queue_size=0)
+  paths = job_service.paths
+  pipeline.close_gate('issue')
+  submit(job_service.spool_dir, 'issue')
+  job_service.claim_jobs()
+  assert state(job_service.spool_dir, 'issue') == 'queued' # its worker is still loading the models
+  assert pdf_names(paths['incoming']) == [] and pdf_names(paths['processing']) == ['issue.pdf']
+
+  assert pipeline.started['issue'].wait(10)
+  assert state(job_service.spool_dir, 'issue') == 'running'
+  pipeline.gates['issue'].set()
+  wait_for(lambda: state(job_service.spool_dir, 'issue') == 'done')
+  assert (paths['done'] / 'issue' / 'issue.docx').read_text(encoding='utf-8') == 'output'
+  assert pdf_names(paths['processing']) == [] and list(paths['tmp'].iterdir()) == []
+
+def test_failed_job_moves_its_pdf_to_failed(pipeline, make_service):
+  job_service = make_service(workers=1, queue_size=0)
+  submit(job_service.spool_dir, 'bad_issue')
+  job_service.claim_jobs()
+  wait_for(lambda: state(job_service.spool_dir, 'bad_issue') == 'failed')
+  assert 'unreadable PDF' in read_status(job_service.spool_dir, 'bad_issue')['error']
+  assert pdf_names(job_service.paths['failed']) == ['bad_issue.pdf']
+  assert pdf_names(job_service.paths['processing']) == [] and not (job_service.paths['done'] / 'bad_issue').exists()
+
+# One job runs and one waits; the third PDF stays in incoming until a slot is released
+def test_full_slots_leave_pdfs_in_incoming(pipeline, make_service):
+  job_service = make_service(workers=1, queue_size=1)
+  job_ids = ['issue_1', 'issue_2', 'issue_3']
+  for job_id in job_ids:
+    pipeline.close_gate(job_id)
+    submit(job_service.spool_dir, job_id)
+  job_service.claim_jobs()
+  job_service.claim_jobs()
+  assert len(pdf_names(job_service.paths['incoming'])) == 1
+  wait_for(lambda: any(pipeline.started[job_id].is_set() for job_id in job_ids))
+  assert sorted((state(job_service.spool_dir, job_id) for job_id in job_ids), key=str) == [None, 'queued', 'running']
+
+  for gate in pipeline.gates.values():
+    gate.set()
+  wait_for(lambda: job_service.claim_jobs() or all(state(job_service.spool_dir, job_id) == 'done' for job_id in job_ids))
+  assert pdf_names(job_service.paths['incoming']) == []
+
+# A resubmitted PDF must not replace the input of the job of the same name while it runs
+def test_pdf_named_like_a_running_job_waits_for_it(pipeline, make_service):
+  job_service = make_service(workers=2, queue_size=2)
+  pipeline.close_gate('issue')
+  submit(job_service.spool_dir, 'issue', b'first')
+  job_service.claim_jobs()
+  assert pipeline.started['issue'].wait(10)
+
+  submit(job_service.spool_dir, 'issue', b'second')
+  job_service.claim_jobs()
+  assert pdf_names(job_service.paths['incoming']) == ['issue.pdf']
+  assert state(job_service.spool_dir, 'issue') == 'running'
+  assert job_service.slots.acquire(blocking=False) # the refused claim released its slot
+  job_service.slots.release()
+
+  pipeline.gates['issue'].set()
+  wait_for(lambda: job_service.claim_jobs() or (len(pipeline.inputs) == 2 and state(job_service.spool_dir, 'issue') == 'done'))
+  assert pipeline.inputs == [b'first', b'second']
+  assert pdf_names(job_service.paths['incoming']) == [] and pdf_names(job_service.paths['failed']) == []
+
+def test_interrupted_jobs_are_requeued_on_restart(pipeline, tmp_path):
+  paths = spool_paths(tmp_path / 'spool')
+  paths['processing'].mkdir(parents=True)
+  (paths['processing'] / 'issue.pdf').write_bytes(b'%PDF-1.7')
+  job_service = Service(tmp_path / 'spool', workers=1, queue_size=0)
+  job_service.executor.shutdown()
+  assert pdf_names(paths['incoming']) == ['issue.pdf'] and pdf_names(paths['processing']) == []
+
+# A stand-in client submits a job as the service starts, while its worker loads the models, and then jobs on the warm worker
+def test_warm_jobs_do_not_wait_for_models(pipeline, make_service):
+  job_service = make_service(workers=1, queue_size=0)
+  def submit_and_wait(job_id):
+    start = time.perf_counter()
+    submit(job_service.spool_dir, job_id)
+    wait_for(lambda: state(job_service.spool_dir, job_id) == 'done')
+    return time.perf_counter() - start
+
+  service_thread = threading.Thread(target=job_service.serve_forever)
+  service_thread.start()
+  try:
+    cold_latency = submit_and_wait('cold')
+    warm_latencies = [submit_and_wait(f'warm_{i}') for i in range(3)]
+  finally:
+    job_service.stop()
+    service_thread.join()
+  assert cold_latency >= MODEL_LOAD_SECONDS
+  assert max(warm_latencies) < MODEL_LOAD_SECONDS